@@ -0,0 +1,292 @@
+import datetime
+import io
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from api.inventory import get_available
+from api.models import Book, GenreStats, OrderItem
+from api.querycheck import allow_repeats
+
+PAID = "success"
+# Books and orders are packed next to their day in one int64 key:
+# day << 32 | id.
+BOOK_BITS = 32
+EMPTY = np.zeros(0, dtype=np.int64)
+
+
+def day_range(first, last):
+    return [first + datetime.timedelta(days=n) for n in range((last - first).days + 1)]
+
+
+def day_start(day):
+    return datetime.datetime.combine(
+        day, datetime.time.min, tzinfo=timezone.get_current_timezone()
+    )
+
+
+def cache_key(day):
+    return f"analytics:sales:v1:{day.isoformat()}"
+
+
+def sum_by_key(keys, *values):
+    """Sorted unique `keys` and the sums of each of `values` per key."""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    sums = [np.bincount(inverse, weights=v, minlength=len(unique)) for v in values]
+    return unique, sums
+
+
+def chunks(queryset, *fields):
+    """
+    Rows of `fields` in id order, ANALYTICS_CHUNK_SIZE at a time. Rows come
+    straight from the cursor: converting them through the ORM costs more
+    than all the NumPy work.
+    """
+    last_id = 0
+    while True:
+        query = (
+            queryset.filter(id__gt=last_id).order_by("id").values_list("id", *fields)
+        )
+        query = query[: settings.ANALYTICS_CHUNK_SIZE]
+        sql, params = query.query.sql_with_params()
+        with connections[query.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield rows
+
+
+def scan_days(first, last):
+    """
+    Per-day sales partials for first..last from one pass over the items of
+    paid orders. Each item row carries its order's day, so an order paid
+    while the chunks are read can never land on another order's day.
+    """
+    days = (last - first).days + 1
+    items = OrderItem.objects.filter(
+        order__status=PAID,
+        order__created_at__gte=day_start(first),
+        order__created_at__lt=day_start(last + datetime.timedelta(days=1)),
+    )
+    items = items.annotate(
+        paid=Coalesce("price", "book__price"), day=TruncDate("order__created_at")
+    )
+
+    revenue = np.zeros(days)
+    units = np.zeros(days)
+    book_keys, book_units, book_revenue = [EMPTY], [EMPTY], [EMPTY]
+    order_keys, order_units = [EMPTY], [EMPTY]
+    for rows in chunks(items, "order_id", "book_id", "quantity", "paid", "day"):
+        _, order_ids, book_ids, quantity, paid, dates = zip(*rows)
+        order_ids = np.array(order_ids, dtype=np.int64)
+        book_ids = np.array(book_ids, dtype=np.int64)
+        quantity = np.array(quantity, dtype=np.int64)
+        amount = quantity * np.array(paid, dtype=np.int64)
+        # Dates arrive as date objects or ISO strings depending on the backend.
+        day = (np.array(dates, dtype="datetime64[D]") - np.datetime64(first)).astype(
+            np.int64
+        )
+        revenue += np.bincount(day, weights=amount, minlength=days)
+        units += np.bincount(day, weights=quantity, minlength=days)
+        keys, (sold, earned) = sum_by_key(
+            (day << BOOK_BITS) | book_ids, quantity, amount
+        )
+        book_keys.append(keys)
+        book_units.append(sold)
+        book_revenue.append(earned)
+        # Order ids fit in the low bits next to their day like book ids.
+        keys, (basket,) = sum_by_key((day << BOOK_BITS) | order_ids, quantity)
+        order_keys.append(keys)
+        order_units.append(basket)
+
+    keys, (sold, earned) = sum_by_key(
+        np.concatenate(book_keys),
+        np.concatenate(book_units),
+        np.concatenate(book_revenue),
+    )
+    bounds = np.searchsorted(keys >> BOOK_BITS, np.arange(days + 1))
+    orders, (sizes,) = sum_by_key(
+        np.concatenate(order_keys), np.concatenate(order_units)
+    )
+    order_days = orders >> BOOK_BITS
+    sizes = sizes.astype(np.int64)
+    width = int(sizes.max(initial=0)) + 1
+    baskets = np.bincount(order_days * width + sizes, minlength=days * width).reshape(
+        days, width
+    )
+    orders_per_day = np.bincount(order_days, minlength=days)
+
+    partials = {}
+    for n, day in enumerate(day_range(first, last)):
+        books = slice(bounds[n], bounds[n + 1])
+        partials[day] = {
+            "revenue": int(revenue[n]),
+            "orders": int(orders_per_day[n]),
+            "units": int(units[n]),
+            "book_ids": keys[books] & ((1 << BOOK_BITS) - 1),
+            "book_units": sold[books].astype(np.int64),
+            "book_revenue": earned[books].astype(np.int64),
+            "baskets": np.trim_zeros(baskets[n], "b"),
+        }
+    return partials
+
+
+def missing_runs(days, window):
+    """Split sorted `days` into runs of consecutive days at most `window` long."""
+    runs = []
+    for day in days:
+        if (
+            runs
+            and day - runs[-1][1] == datetime.timedelta(days=1)
+            and (day - runs[-1][0]).days < window
+        ):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return runs
+
+
+def daily_partials(first, last):
+    """
+    Sales partials for each day, cached once a day is older than
+    ANALYTICS_SETTLE_DAYS so late payment callbacks still count. Only days
+    missing from the cache are read from the database.
+    """
+    settled = timezone.localdate() - datetime.timedelta(
+        days=settings.ANALYTICS_SETTLE_DAYS
+    )
+    days = day_range(first, last)
+    keys = {cache_key(day): day for day in days if day < settled}
+    partials = {keys[key]: value for key, value in cache.get_many(keys).items()}
+    missing = [day for day in days if day not in partials]
+    for run_first, run_last in missing_runs(missing, settings.ANALYTICS_WINDOW_DAYS):
+        with allow_repeats():
+            scanned = scan_days(run_first, run_last)
+        partials.update(scanned)
+        cache.set_many(
+            {cache_key(day): value for day, value in scanned.items() if day < settled},
+            settings.ANALYTICS_CACHE_TTL,
+        )
+    return [(day, partials[day]) for day in days]
+
+
+def percentile(histogram, q):
+    total = histogram.sum()
+    if not total:
+        return None
+    return int(np.searchsorted(np.cumsum(histogram), q / 100 * total))
+
+
+def sales_summary(first, last, top=10):
+    partials = daily_partials(first, last)
+    daily = [
+        {
+            "date": day.isoformat(),
+            "revenue": p["revenue"],
+            "orders": p["orders"],
+            "units": p["units"],
+        }
+        for day, p in partials
+    ]
+    revenue = sum(p["revenue"] for _, p in partials)
+    orders = sum(p["orders"] for _, p in partials)
+    units = sum(p["units"] for _, p in partials)
+
+    book_ids, (book_units, book_revenue) = sum_by_key(
+        np.concatenate([p["book_ids"] for _, p in partials]),
+        np.concatenate([p["book_units"] for _, p in partials]),
+        np.concatenate([p["book_revenue"] for _, p in partials]),
+    )
+    best = np.argsort(-book_revenue, kind="stable")[:top]
+    books = Book.objects.only("title", "quantity", "stock_shards").in_bulk(
+        book_ids[best].tolist()
+    )
+    stock = get_available(books.values())
+    top_books = []
+    for i in best:
+        book_id, sold = int(book_ids[i]), int(book_units[i])
+        in_stock = max(stock.get(book_id, 0), 0)
+        top_books.append(
+            {
+                "id": book_id,
+                "title": books[book_id].title if book_id in books else None,
+                "units": sold,
+                "revenue": int(book_revenue[i]),
+                "sell_through": round(sold / (sold + in_stock), 4) if sold else 0,
+            }
+        )
+
+    width = max(len(p["baskets"]) for _, p in partials)
+    baskets = np.zeros(width, dtype=np.int64)
+    for _, p in partials:
+        baskets[: len(p["baskets"])] += p["baskets"]
+    sizes = np.arange(width)
+    total_stock = sum(GenreStats.objects.values_list("stock_quantity", flat=True))
+
+    return {
+        "start": first.isoformat(),
+        "end": last.isoformat(),
+        "revenue": revenue,
+        "orders": orders,
+        "units": units,
+        "average_order_value": round(revenue / orders, 2) if orders else None,
+        "sell_through": (
+            round(units / (units + total_stock), 4) if units + total_stock else None
+        ),
+        "daily": daily,
+        "top_books": top_books,
+        "basket_sizes": {
+            "mean": (
+                round(float((sizes * baskets).sum() / orders), 2) if orders else None
+            ),
+            "p50": percentile(baskets, 50),
+            "p90": percentile(baskets, 90),
+            "p99": percentile(baskets, 99),
+            "histogram": [
+                {"size": int(size), "orders": int(count)}
+                for size, count in zip(sizes, baskets)
+                if count
+            ],
+        },
+    }
+
+
+CHARTS = ("revenue", "baskets", "top_books")
+
+
+def render_chart(summary, chart):
+    # Figure without pyplot keeps rendering thread-safe and off any GUI backend.
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(8, 4), dpi=100)
+    axes = figure.subplots()
+    if chart == "revenue":
+        days = [np.datetime64(row["date"]) for row in summary["daily"]]
+        axes.bar(days, [row["revenue"] for row in summary["daily"]])
+        axes.set_ylabel("Revenue")
+        figure.autofmt_xdate()
+    elif chart == "baskets":
+        histogram = summary["basket_sizes"]["histogram"]
+        axes.bar(
+            [row["size"] for row in histogram], [row["orders"] for row in histogram]
+        )
+        axes.set_xlabel("Books per order")
+        axes.set_ylabel("Orders")
+    else:
+        books = summary["top_books"][::-1]
+        axes.barh(
+            [book["title"] or str(book["id"]) for book in books],
+            [book["revenue"] for book in books],
+        )
+        axes.set_xlabel("Revenue")
+    axes.set_title(f"{summary['start']} - {summary['end']}")
+    figure.tight_layout()
+    output = io.BytesIO()
+    figure.savefig(output, format="png")
+    return output.getvalue()
@@ -0,0 +1,52 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+
+
+class UserStateCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.active = {}
+        self.lock = threading.Lock()
+
+    def is_active(self, user_id):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.active.get(user_id)
+        if entry is not None and now - entry[1] <= self.ttl:
+            return entry[0]
+        active = User.objects.filter(id=user_id, is_active=True).exists()
+        with self.lock:
+            self.active[user_id] = (active, now)
+        return active
+
+    def discard(self, user_id):
+        with self.lock:
+            self.active.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.active.clear()
+
+
+user_states = UserStateCache(settings.TOKEN_USER_STATE_TTL)
+
+
+class TokenUserAuthentication(JWTStatelessUserAuthentication):
+    """
+    Builds the user from the token claims instead of loading the row. Deleted
+    or deactivated users are still rejected, at most TOKEN_USER_STATE_TTL
+    seconds late in other processes.
+    """
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        if settings.TOKEN_USER_STATE_TTL is not None and not user_states.is_active(
+            user.id
+        ):
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        return user
@@ -0,0 +1,67 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import parse_etags, urlencode
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+VERSION_KEY = "catalogue:version"
+
+
+def get_catalogue_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # A fresh version must not collide with entries cached before the
+        # version key was evicted.
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalogue_version():
+    def bump():
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, time.time_ns(), None)
+
+    transaction.on_commit(bump)
+
+
+class CachedResponseMixin:
+    def get_cache_key(self, request):
+        params = urlencode(
+            sorted(
+                (key, value)
+                for key, values in request.query_params.lists()
+                for value in values
+            )
+        )
+        digest = hashlib.md5(f"{request.path}?{params}".encode()).hexdigest()
+        return f"catalogue:{get_catalogue_version()}:{digest}"
+
+    def make_cache_entry(self, data):
+        content = json.dumps(data, cls=JSONEncoder, sort_keys=True)
+        return data, f'"{hashlib.md5(content.encode()).hexdigest()}"'
+
+    def is_not_modified(self, request, etag):
+        return etag in parse_etags(request.headers.get("If-None-Match", ""))
+
+    def get(self, request, *args, **kwargs):
+        key = self.get_cache_key(request)
+        cached = cache.get(key)
+        fresh = cached is None
+        if fresh:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            cached = self.make_cache_entry(response.data)
+            cache.set(key, cached, settings.CATALOGUE_CACHE_TTL)
+        data, etag = self.overlay_stock(*cached, fresh=fresh)
+        if self.is_not_modified(request, etag):
+            return Response(status=304, headers={"ETag": etag})
+        return Response(data, headers={"ETag": etag})
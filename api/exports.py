@@ -0,0 +1,50 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from api.renderers import CSVRenderer, NDJSONRenderer
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def stream_csv(fields, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(
+            value.isoformat() if hasattr(value, "isoformat") else value for value in row
+        )
+
+
+def stream_ndjson(fields, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+class ExportMixin:
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+    pagination_class = None
+    export_name = None
+    export_fields = []
+    chunk_size = 2000
+
+    def get(self, request, *args, **kwargs):
+        rows = (
+            self.filter_queryset(self.get_queryset())
+            .values_list(*self.export_fields)
+            .iterator(chunk_size=self.chunk_size)
+        )
+        renderer = request.accepted_renderer
+        stream = stream_csv if renderer.format == "csv" else stream_ndjson
+        response = StreamingHttpResponse(
+            stream(self.export_fields, rows), content_type=renderer.media_type
+        )
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="{self.export_name}.{renderer.format}"'
+        return response
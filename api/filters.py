@@ -0,0 +1,32 @@
+import django_filters
+
+from api.models import Order
+
+
+class CharInFilter(django_filters.BaseInFilter, django_filters.CharFilter):
+    pass
+
+
+class OrderFilter(django_filters.FilterSet):
+    """
+    Exact and range filters for the order list and export, for example
+    `?status=success,failure&created_after=2024-01-01&total_price_min=100`.
+    """
+
+    status = CharInFilter()
+    created_after = django_filters.DateTimeFilter(
+        field_name="created_at", lookup_expr="gte"
+    )
+    created_before = django_filters.DateTimeFilter(
+        field_name="created_at", lookup_expr="lt"
+    )
+    total_price_min = django_filters.NumberFilter(
+        field_name="total_price", lookup_expr="gte"
+    )
+    total_price_max = django_filters.NumberFilter(
+        field_name="total_price", lookup_expr="lte"
+    )
+
+    class Meta:
+        model = Order
+        fields = ["invoice_id"]
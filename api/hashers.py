@@ -0,0 +1,67 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import exceptions
+
+
+class HashingBusy(exceptions.APIException):
+    status_code = 503
+    default_detail = "Too many logins at once, try again shortly."
+    default_code = "hashing_busy"
+
+
+class HashingPool:
+    """
+    Runs password hashing on a few threads and turns requests away when
+    `workers + queue` hashes are already running or waiting, so login spikes
+    cannot take every request thread.
+    """
+
+    def __init__(self, workers, queue):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="hashing")
+        self.slots = threading.BoundedSemaphore(workers + queue)
+        self.local = threading.local()
+
+    def run(self, fn, *args, **kwargs):
+        # verify() calls encode(); hash it in the thread that is already here.
+        if getattr(self.local, "inside", False):
+            return fn(*args, **kwargs)
+        if not self.slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            return self.executor.submit(self.call, fn, args, kwargs).result()
+        finally:
+            self.slots.release()
+
+    def call(self, fn, args, kwargs):
+        self.local.inside = True
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.local.inside = False
+
+
+pool = HashingPool(settings.PASSWORD_HASHING_WORKERS, settings.PASSWORD_HASHING_QUEUE)
+
+
+class PooledHasherMixin:
+    def encode(self, password, salt, *args, **kwargs):
+        return pool.run(super().encode, password, salt, *args, **kwargs)
+
+    def verify(self, password, encoded):
+        return pool.run(super().verify, password, encoded)
+
+
+class ScryptPasswordHasher(PooledHasherMixin, hashers.ScryptPasswordHasher):
+    work_factor = settings.PASSWORD_SCRYPT_WORK_FACTOR
+
+
+class Argon2PasswordHasher(PooledHasherMixin, hashers.Argon2PasswordHasher):
+    time_cost = settings.PASSWORD_ARGON2_TIME_COST
+    memory_cost = settings.PASSWORD_ARGON2_MEMORY_COST
+
+
+class PBKDF2PasswordHasher(PooledHasherMixin, hashers.PBKDF2PasswordHasher):
+    pass
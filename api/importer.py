@@ -0,0 +1,116 @@
+import codecs
+import csv
+import json
+from itertools import islice
+
+from django.db import transaction
+
+from api.cache import bump_catalogue_version
+from api.inventory import set_stock
+from api.models import Author, Book
+from api.querycheck import allow_repeats
+from api.serializers import BookImportSerializer
+from api.stockgate import get_stock_gate
+from api.tasks import get_queue
+
+FORMATS = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+UPDATE_FIELDS = ["title", "author", "genre", "publication_date", "price", "quantity"]
+
+
+def read_rows(lines, format):
+    lines = codecs.iterdecode(lines, "utf-8-sig")
+    if format == "csv":
+        yield from enumerate(csv.DictReader(lines), start=1)
+        return
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+def import_books(rows, batch_size=1000):
+    report = {"created": 0, "updated": 0, "errors": []}
+    authors = dict(Author.objects.values_list("name", "id"))
+    rows = iter(rows)
+    while chunk := list(islice(rows, batch_size)):
+        valid = []
+        for number, row in chunk:
+            if row is None:
+                report["errors"].append({"row": number, "errors": "Invalid JSON"})
+                continue
+            serializer = BookImportSerializer(data=row)
+            if serializer.is_valid():
+                valid.append((number, serializer.validated_data))
+            else:
+                report["errors"].append({"row": number, "errors": serializer.errors})
+        with transaction.atomic(), allow_repeats():
+            import_chunk(valid, authors, report)
+    report["errors"].sort(key=lambda error: error["row"])
+    bump_catalogue_version()
+    get_queue().enqueue("api.stats.rebuild_stats")
+    if get_stock_gate() is not None:
+        get_queue().enqueue("api.stockgate.reconcile_stock_gate")
+    return report
+
+
+def import_chunk(rows, authors, report):
+    new_authors = {row["author"] for _, row in rows} - authors.keys()
+    if new_authors:
+        for author in Author.objects.bulk_create(
+            Author(name=name) for name in new_authors
+        ):
+            authors[author.name] = author.id
+
+    by_isbn = {}
+    isbn_rows = {}
+    without_isbn = []
+    for number, row in rows:
+        book = Book(
+            isbn=row.get("isbn") or None,
+            title=row["title"],
+            author_id=authors[row["author"]],
+            genre=row["genre"],
+            publication_date=row["publication_date"],
+            price=row["price"],
+            quantity=row["quantity"],
+        )
+        if book.isbn:
+            # A repeated ISBN inside one statement cannot be upserted twice;
+            # the last row wins and the earlier one is reported.
+            if book.isbn in isbn_rows:
+                report["errors"].append(
+                    {
+                        "row": isbn_rows[book.isbn],
+                        "errors": f"Superseded by row {number} with the same ISBN",
+                    }
+                )
+            by_isbn[book.isbn] = book
+            isbn_rows[book.isbn] = number
+        else:
+            without_isbn.append(book)
+
+    existing = dict(
+        Book.objects.filter(isbn__in=by_isbn).values_list("isbn", "stock_shards")
+    )
+    if by_isbn:
+        Book.objects.bulk_create(
+            by_isbn.values(),
+            update_conflicts=True,
+            unique_fields=["isbn"],
+            update_fields=UPDATE_FIELDS,
+        )
+        for isbn, shards in existing.items():
+            if shards:
+                # The upsert overwrote Book.quantity; spread it over the shards.
+                set_stock(Book.objects.get(isbn=isbn), by_isbn[isbn].quantity)
+    if without_isbn:
+        Book.objects.bulk_create(without_isbn)
+    report["updated"] += len(existing)
+    report["created"] += len(by_isbn) - len(existing) + len(without_isbn)
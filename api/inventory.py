@@ -0,0 +1,237 @@
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Exists, F, Q, Sum, When
+
+from api.cache import bump_catalogue_version
+from api.models import Book, StockShard
+from api.querycheck import allow_repeats
+from api.stats import (
+    book_change,
+    queue_stats,
+    record_stock_movement,
+    stored_book_state,
+)
+from api.stockgate import get_stock_gate
+
+
+def stock_cache_key(book_id):
+    return f"stock:{book_id}"
+
+
+def invalidate_stock(book_ids):
+    keys = [stock_cache_key(book_id) for book_id in book_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def shard_totals(book_ids):
+    totals = dict.fromkeys(book_ids, 0)
+    totals.update(
+        StockShard.objects.filter(book_id__in=book_ids)
+        .values("book_id")
+        .annotate(total=Sum("quantity"))
+        .values_list("book_id", "total")
+    )
+    return totals
+
+
+def remember_stock(levels):
+    cache.set_many(
+        {stock_cache_key(book_id): level for book_id, level in levels.items()},
+        settings.STOCK_CACHE_TTL,
+    )
+
+
+def get_available(books):
+    available = {book.id: book.quantity for book in books if not book.stock_shards}
+    keys = {stock_cache_key(book.id): book.id for book in books if book.stock_shards}
+    if not keys:
+        return available
+    cached = cache.get_many(keys)
+    available.update((keys[key], quantity) for key, quantity in cached.items())
+    missing = [book_id for key, book_id in keys.items() if key not in cached]
+    if missing:
+        totals = shard_totals(missing)
+        remember_stock(totals)
+        available.update(totals)
+    return available
+
+
+def get_stock_levels(book_ids):
+    """
+    Available stock of `book_ids`, cached per book for STOCK_CACHE_TTL
+    seconds. Cached catalogue pages take their quantities from here, so
+    checkouts do not have to invalidate them.
+    """
+    keys = {stock_cache_key(book_id): book_id for book_id in book_ids}
+    cached = cache.get_many(keys)
+    levels = {keys[key]: level for key, level in cached.items()}
+    missing = [book_id for key, book_id in keys.items() if key not in cached]
+    if missing:
+        fresh, sharded = {}, []
+        for book_id, quantity, shards in Book.objects.filter(
+            id__in=missing
+        ).values_list("id", "quantity", "stock_shards"):
+            if shards:
+                sharded.append(book_id)
+            else:
+                fresh[book_id] = quantity
+        if sharded:
+            fresh.update(shard_totals(sharded))
+        remember_stock(fresh)
+        levels.update(fresh)
+    return levels
+
+
+def take_stock(quantities, books):
+    """
+    Take `quantities` ({book_id: quantity}) out of stock or return False if
+    any book is short; the caller rolls back its transaction in that case.
+    """
+    unsharded = {
+        book_id: quantity
+        for book_id, quantity in quantities.items()
+        if not books[book_id].stock_shards
+    }
+    if unsharded:
+        in_stock = Q()
+        for book_id, quantity in unsharded.items():
+            in_stock |= Q(id=book_id, quantity__gte=quantity)
+        updated = Book.objects.filter(in_stock).update(
+            quantity=Case(
+                *(
+                    When(id=book_id, then=F("quantity") - quantity)
+                    for book_id, quantity in unsharded.items()
+                ),
+                default=F("quantity"),
+            )
+        )
+        if updated != len(unsharded):
+            return False
+    # Book id order keeps concurrent baskets from locking shards in a cycle.
+    sharded = sorted(quantities.keys() - unsharded.keys())
+    for book_id in sharded:
+        if not take_from_shards(
+            book_id, books[book_id].stock_shards, quantities[book_id]
+        ):
+            return False
+    invalidate_stock(quantities)
+    record_stock_movement({k: -v for k, v in quantities.items()}, books)
+    return True
+
+
+def spread(quantity, shards):
+    """`quantity` split evenly over `shards`; a shortage stays on shard 0."""
+    if quantity < 0 and shards:
+        return [quantity] + [0] * (shards - 1)
+    return [quantity // shards + (index < quantity % shards) for index in range(shards)]
+
+
+def take_from_shards(book_id, shards, quantity):
+    indexes = list(range(shards))
+    random.shuffle(indexes)
+    # A negative shard means the other shards overstate the stock, so no
+    # single shard may be trusted until rebalance_shards evens them out.
+    short = StockShard.objects.filter(book_id=book_id, quantity__lt=0)
+    with allow_repeats():
+        for index in indexes:
+            if (
+                StockShard.objects.filter(
+                    book_id=book_id, index=index, quantity__gte=quantity
+                )
+                .filter(~Exists(short))
+                .update(quantity=F("quantity") - quantity)
+            ):
+                return True
+    # No single shard can cover the quantity: lock them all and take it from
+    # their total.
+    return rebalance_shards(book_id, -quantity)
+
+
+def rebalance_shards(book_id, delta, check=True):
+    """
+    Add `delta` to the shard total of `book_id` and spread it evenly again
+    under a lock; with `check`, return False instead of going below zero.
+    """
+    rows = list(
+        StockShard.objects.select_for_update().filter(book_id=book_id).order_by("index")
+    )
+    total = sum(row.quantity for row in rows) + delta
+    if check and total < 0:
+        return False
+    for row, quantity in zip(rows, spread(total, len(rows))):
+        row.quantity = quantity
+    StockShard.objects.bulk_update(rows, ["quantity"])
+    return True
+
+
+def add_stock(deltas):
+    """Add `deltas` ({book_id: quantity}, negative to take) without checks."""
+    books = Book.objects.only("author_id", "genre", "price", "stock_shards")
+    books = books.in_bulk(deltas)
+    shards = {k: book.stock_shards for k, book in books.items() if book.stock_shards}
+    unsharded = {k: v for k, v in deltas.items() if k not in shards}
+    if unsharded:
+        Book.objects.filter(id__in=unsharded).update(
+            quantity=Case(
+                *(
+                    When(id=book_id, then=F("quantity") + delta)
+                    for book_id, delta in unsharded.items()
+                ),
+                default=F("quantity"),
+            )
+        )
+    for book_id in sorted(shards):
+        if deltas[book_id] < 0:
+            # Taking from a random shard could leave it negative while the
+            # others still look sellable.
+            rebalance_shards(book_id, deltas[book_id], check=False)
+        else:
+            StockShard.objects.filter(
+                book_id=book_id, index=random.randrange(shards[book_id])
+            ).update(quantity=F("quantity") + deltas[book_id])
+    invalidate_stock(deltas)
+    record_stock_movement({k: v for k, v in deltas.items() if k in books}, books)
+    gate = get_stock_gate()
+    if gate is not None:
+        transaction.on_commit(lambda: gate.add(deltas))
+
+
+def set_stock(book, quantity, shards=None):
+    """
+    Set the stock of `book` to `quantity`, spread evenly over `shards`
+    counters (the book's current shard count by default, 0 for none).
+    """
+    if shards is None:
+        shards = book.stock_shards
+    with transaction.atomic():
+        Book.objects.select_for_update().filter(id=book.id).first()
+        state = stored_book_state(book.id)
+        StockShard.objects.filter(book=book).delete()
+        StockShard.objects.bulk_create(
+            StockShard(book=book, index=index, quantity=shard_quantity)
+            for index, shard_quantity in enumerate(spread(quantity, shards))
+        )
+        Book.objects.filter(id=book.id).update(quantity=quantity, stock_shards=shards)
+        book.quantity, book.stock_shards = quantity, shards
+        if state is not None:
+            queue_stats([book_change(state[:3] + (quantity,)), book_change(state, -1)])
+        bump_catalogue_version()
+        invalidate_stock([book.id])
+        gate = get_stock_gate()
+        if gate is not None:
+            transaction.on_commit(lambda: gate.set_levels({book.id: quantity}))
+
+
+def sync_sharded_stock():
+    """Copy shard totals into Book.quantity for exports, ordering and search."""
+    totals = (
+        StockShard.objects.values("book_id")
+        .annotate(total=Sum("quantity"))
+        .values_list("book_id", "total")
+    )
+    for book_id, total in totals:
+        Book.objects.filter(id=book_id).exclude(quantity=total).update(quantity=total)
@@ -0,0 +1,22 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.importer import import_books, read_rows
+
+
+class Command(BaseCommand):
+    help = "Create or update books from a CSV or NDJSON file, matching on isbn."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "ndjson"])
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        format = options["format"] or (
+            "csv" if options["path"].endswith(".csv") else "ndjson"
+        )
+        with open(options["path"], "rb") as file:
+            report = import_books(read_rows(file, format), options["batch_size"])
+        self.stdout.write(json.dumps(report, indent=2, default=str))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.models import AuthorStats, GenreStats
+from api.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the author and genre catalogue statistics from the books."
+
+    def handle(self, *args, **options):
+        rebuild_stats()
+        self.stdout.write(
+            f"Rebuilt statistics for {AuthorStats.objects.count()} authors and "
+            f"{GenreStats.objects.count()} genres."
+        )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.stockgate import get_stock_gate
+
+
+class Command(BaseCommand):
+    help = "Rebuild the stock gate from the database and correct drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        gate = get_stock_gate()
+        if gate is None:
+            raise CommandError("No stock gate is configured (STOCK_GATE).")
+        corrected = gate.reconcile(options["batch_size"])
+        self.stdout.write(f"Corrected the stock gate for {corrected} books.")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.mono import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = "Return the stock of expired holds and mark their orders expired."
+
+    def handle(self, *args, **options):
+        released = release_expired_holds()
+        self.stdout.write(f"Released holds of {released} orders.")
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.inventory import sync_sharded_stock
+from api.mono import release_expired_holds
+from api.stockgate import reconcile_stock_gate
+from api.tasks import DatabaseQueue
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background tasks stored by the database task queue, release "
+        "expired stock holds, sync sharded stock totals and reconcile the "
+        "stock gate."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--sleep", type=float, default=1.0)
+        parser.add_argument("--sweep-interval", type=float, default=30.0)
+        parser.add_argument("--once", action="store_true", help="Exit after one pass.")
+
+    def handle(self, *args, **options):
+        queue = DatabaseQueue()
+        last_sweep = None
+        while True:
+            processed = queue.run_pending(options["batch_size"])
+            now = time.monotonic()
+            if last_sweep is None or now - last_sweep >= options["sweep_interval"]:
+                release_expired_holds()
+                sync_sharded_stock()
+                reconcile_stock_gate()
+                last_sweep = now
+            if options["once"]:
+                break
+            if not processed:
+                time.sleep(options["sleep"])
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.inventory import get_available, set_stock
+from api.models import Book
+
+
+class Command(BaseCommand):
+    help = "Spread the stock of a book over N counter rows (0 to unshard)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("book_id", type=int)
+        parser.add_argument("--shards", type=int, required=True)
+
+    def handle(self, *args, **options):
+        if not 0 <= options["shards"] <= 256:
+            raise CommandError("--shards must be between 0 and 256.")
+        try:
+            book = Book.objects.get(id=options["book_id"])
+        except Book.DoesNotExist:
+            raise CommandError(f"Book {options['book_id']} does not exist.")
+        quantity = get_available([book])[book.id]
+        set_stock(book, quantity, options["shards"])
+        self.stdout.write(
+            f"Book {book.id}: {quantity} in stock over {options['shards']} shards."
+        )
@@ -0,0 +1,205 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound
+from rest_framework import serializers
+
+request_timings = ContextVar("request_timings", default=None)
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    """
+    In-process Prometheus histogram. Every worker process keeps its own
+    series, so scrape each worker (or run one) for complete numbers.
+    """
+
+    def __init__(self, name, description, buckets=TIME_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            series = sorted(self.series.items())
+            for key, (counts, total, count) in series:
+                labels = [f'{name}="{value}"' for name, value in key]
+                for bound, bucket in zip(self.buckets, counts):
+                    le = ",".join(labels + [f'le="{bound}"'])
+                    lines.append(f"{self.name}_bucket{{{le}}} {bucket}")
+                le = ",".join(labels + ['le="+Inf"'])
+                lines.append(f"{self.name}_bucket{{{le}}} {count}")
+                labels = "{" + ",".join(labels) + "}" if labels else ""
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return "\n".join(lines)
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to produce the response."
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "SQL queries per request.", QUERY_BUCKETS
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_duration_seconds", "Time spent in SQL queries per request."
+)
+REQUEST_SERIALIZER_SECONDS = Histogram(
+    "http_request_serializer_duration_seconds",
+    "Time spent serializing responses per request.",
+)
+MONOBANK_SECONDS = Histogram(
+    "monobank_request_duration_seconds", "Time of each HTTP call to Monobank."
+)
+HISTOGRAMS = [
+    REQUEST_SECONDS,
+    REQUEST_QUERIES,
+    REQUEST_DB_SECONDS,
+    REQUEST_SERIALIZER_SECONDS,
+    MONOBANK_SECONDS,
+]
+
+
+def record(name, seconds):
+    timings = request_timings.get()
+    if timings is not None:
+        count, total = timings.get(name, (0, 0.0))
+        timings[name] = (count + 1, total + seconds)
+
+
+@contextmanager
+def timed(name, histogram=None, **labels):
+    """Add the time spent in the block to the current request under `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        record(name, elapsed)
+        if histogram is not None:
+            histogram.observe(elapsed, **labels)
+
+
+def record_query(execute, sql, params, many, context):
+    if request_timings.get() is None:
+        return execute(sql, params, many, context)
+    with timed("db"):
+        return execute(sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+# Async views query from other threads, each with its own connection.
+connection_created.connect(install_query_recorder)
+
+
+class TimedListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        with timed("serializer"):
+            return super().data
+
+
+class TimedSerializerMixin:
+    """Counts building `data` as serializer time of the current request."""
+
+    @property
+    def data(self):
+        with timed("serializer"):
+            return super().data
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start, token = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = request_timings.get()
+            request_timings.reset(token)
+        return self.finish(request, response, timings, start)
+
+    async def __acall__(self, request):
+        start, token = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = request_timings.get()
+            request_timings.reset(token)
+        return self.finish(request, response, timings, start)
+
+    def start(self):
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+        return time.perf_counter(), request_timings.set({})
+
+    def finish(self, request, response, timings, start):
+        total = time.perf_counter() - start
+        match = getattr(request, "resolver_match", None)
+        labels = {
+            "view": match.view_name if match else "unresolved",
+            "method": request.method,
+        }
+        queries, db_seconds = timings.get("db", (0, 0.0))
+        REQUEST_SECONDS.observe(total, **labels)
+        REQUEST_QUERIES.observe(queries, **labels)
+        REQUEST_DB_SECONDS.observe(db_seconds, **labels)
+        REQUEST_SERIALIZER_SECONDS.observe(
+            timings.get("serializer", (0, 0.0))[1], **labels
+        )
+        entries = [f'db;dur={db_seconds * 1000:.1f};desc="{queries} queries"']
+        for name, (count, seconds) in timings.items():
+            if name != "db":
+                entries.append(f'{name};dur={seconds * 1000:.1f};desc="{count} calls"')
+        entries.append(f"total;dur={total * 1000:.1f}")
+        response["Server-Timing"] = ", ".join(entries)
+        return response
+
+
+def metrics(request):
+    token = settings.METRICS_TOKEN
+    if not token:
+        # Route timings and query counts are only public while debugging.
+        if not settings.DEBUG:
+            return HttpResponseNotFound()
+    elif request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponseForbidden()
+    body = "\n".join(histogram.render() for histogram in HISTOGRAMS) + "\n"
+    return HttpResponse(body, content_type="text/plain; version=0.0.4")
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.3 on 2026-10-18 18:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0003_order_page_url_orderitem_price_task"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="status_modified_at",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.CreateModel(
+            name="MonoCallback",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("invoice_id", models.CharField(max_length=200)),
+                ("status", models.CharField(max_length=200)),
+                ("modified_date", models.DateTimeField()),
+                ("reference", models.CharField(max_length=200)),
+                ("received_at", models.DateTimeField(auto_now_add=True)),
+                ("processed", models.BooleanField(default=False)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("processed", False)),
+                        fields=["id"],
+                        name="mono_callback_unprocessed",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="monocallback",
+            constraint=models.UniqueConstraint(
+                fields=("invoice_id", "status", "modified_date"),
+                name="unique_mono_callback",
+            ),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0008_stockshard"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AuthorStats",
+            fields=[
+                ("book_count", models.IntegerField(default=0)),
+                ("stock_quantity", models.BigIntegerField(default=0)),
+                ("stock_value", models.BigIntegerField(default=0)),
+                (
+                    "author",
+                    models.OneToOneField(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to="api.author",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="GenreStats",
+            fields=[
+                ("book_count", models.IntegerField(default=0)),
+                ("stock_quantity", models.BigIntegerField(default=0)),
+                ("stock_value", models.BigIntegerField(default=0)),
+                (
+                    "genre",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0009_catalogue_stats"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="order",
+            name="invoice_id",
+            field=models.CharField(max_length=200, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["status", "created_at"], name="api_order_status_1d49fe_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["created_at", "id"], name="api_order_created_69f47b_idx"
+            ),
+        ),
+    ]
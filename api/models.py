@@ -1,33 +1,128 @@
-import requests
-from django.conf import settings
 from django.db import models
 
+from api.monobank import get_client
+
 
 class Author(models.Model):
     name = models.CharField(max_length=100)
 
+    class Meta:
+        indexes = [models.Index(fields=["name", "id"])]
+
 
 class Book(models.Model):
+    isbn = models.CharField(max_length=20, unique=True, null=True, blank=True)
     title = models.CharField(max_length=100)
     author = models.ForeignKey(Author, on_delete=models.CASCADE)
     genre = models.CharField(max_length=100)
     publication_date = models.DateField()
     price = models.PositiveIntegerField()
     quantity = models.IntegerField()
+    stock_shards = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["price", "id"]),
+            models.Index(fields=["quantity", "id"]),
+            models.Index(fields=["publication_date", "id"]),
+            models.Index(fields=["genre", "id"]),
+        ]
 
 
 class Order(models.Model):
     books = models.ManyToManyField(Book, through="OrderItem")
     total_price = models.PositiveIntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
-    invoice_id = models.CharField(max_length=200, null=True)
+    invoice_id = models.CharField(max_length=200, null=True, unique=True)
     status = models.CharField(max_length=200, null=True)
+    status_modified_at = models.DateTimeField(null=True)
+    page_url = models.CharField(max_length=200, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+            models.Index(fields=["created_at", "id"]),
+        ]
 
 
 class OrderItem(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     quantity = models.IntegerField()
+    price = models.PositiveIntegerField(null=True)
+
+
+class StockShard(models.Model):
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    index = models.PositiveSmallIntegerField()
+    quantity = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["book", "index"], name="unique_book_shard")
+        ]
+
+
+class StockHold(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    quantity = models.IntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+
+class CatalogueStats(models.Model):
+    book_count = models.IntegerField(default=0)
+    stock_quantity = models.BigIntegerField(default=0)
+    stock_value = models.BigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class AuthorStats(CatalogueStats):
+    # No FK constraint: books deleted with their author update this row
+    # before the author's post_delete removes it.
+    author = models.OneToOneField(
+        Author,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        primary_key=True,
+        related_name="stats",
+    )
+
+
+class GenreStats(CatalogueStats):
+    genre = models.CharField(max_length=100, primary_key=True)
+
+
+class MonoCallback(models.Model):
+    invoice_id = models.CharField(max_length=200)
+    status = models.CharField(max_length=200)
+    modified_date = models.DateTimeField()
+    reference = models.CharField(max_length=200)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["invoice_id", "status", "modified_date"],
+                name="unique_mono_callback",
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=models.Q(processed=False),
+                name="mono_callback_unprocessed",
+            )
+        ]
+
+
+class Task(models.Model):
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
 
 
 class MonoSettings(models.Model):
@@ -38,9 +133,10 @@ class MonoSettings(models.Model):
         try:
             return cls.objects.last().public_key
         except AttributeError:
-            key = requests.get(
-                "https://api.monobank.ua/api/merchant/pubkey",
-                headers={"X-Token": settings.MONOBANK_API_KEY},
-            ).json()["key"]
-            cls.objects.create(public_key=key)
-            return key
+            return cls.refresh_token()
+
+    @classmethod
+    def refresh_token(cls):
+        key = get_client().get_pubkey()
+        cls.objects.create(public_key=key)
+        return key
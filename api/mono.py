@@ -1,82 +1,325 @@
 import base64
-import hashlib
+import logging
+import threading
+import time
+from datetime import timedelta
 
-import ecdsa
-import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 
-from api.models import Order, OrderItem
+from api.inventory import add_stock, take_stock
+from api.models import (
+    Book,
+    MonoCallback,
+    MonoSettings,
+    Order,
+    OrderItem,
+    StockHold,
+)
+from api.monobank import MonobankError, get_async_client, get_client
+from api.signatures import get_verifier
+from api.stockgate import get_stock_gate
+from api.tasks import get_queue
 
+logger = logging.getLogger(__name__)
 
-def create_order(order_data, webhook_url):
-    basketOrder = []
-    order_items = []
-    amount = 0
+RESTOCK_STATUSES = {"failure", "expired", "reversed", "hold"}
 
-    order = Order.objects.create(total_price=0)
 
+def create_order(order_data, webhook_url):
+    quantities = {}
     for order_item in order_data:
-        if order_item["quantity"] > order_item["book_id"].quantity:
-            response_data = {
-                "error": "Not enough books in stock",
-                "status": 400,
-            }
-            return response_data
-
-        else:
-            order_item["book_id"].quantity -= order_item["quantity"]
-            order_item["book_id"].save()
-            item_sum = order_item["book_id"].price * order_item["quantity"]
-            basketOrder.append(
-                {
-                    "name": order_item["book_id"].title,
-                    "qty": order_item["quantity"],
-                    "sum": item_sum,
-                    "unit": "шт.",
-                }
+        book_id = order_item["book_id"].id
+        quantities[book_id] = quantities.get(book_id, 0) + order_item["quantity"]
+    out_of_stock = {
+        "error": "Not enough books in stock",
+        "status": 400,
+    }
+
+    gate = get_stock_gate()
+    taken = gate.take(quantities) if gate is not None else None
+    if taken is False:
+        return out_of_stock
+    order = None
+    try:
+        order = place_order(quantities, webhook_url)
+    finally:
+        if order is None and taken:
+            gate.add(quantities)
+    if order is None:
+        return out_of_stock
+    return {"id": order.id, "status": order.status}
+
+
+def place_order(quantities, webhook_url):
+    with transaction.atomic():
+        # No row locks up front: take_stock only takes what is still there,
+        # so hot books spread over stock shards are not serialized on their
+        # Book row.
+        books = Book.objects.in_bulk(quantities)
+        if books.keys() != quantities.keys():
+            return None
+        if not take_stock(quantities, books):
+            transaction.set_rollback(True)
+            return None
+
+        order = Order.objects.create(
+            total_price=sum(
+                books[book_id].price * quantity
+                for book_id, quantity in quantities.items()
+            ),
+            status="pending_invoice",
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                book_id=book_id,
+                order=order,
+                quantity=quantity,
+                price=books[book_id].price,
             )
-            item = OrderItem.objects.create(
-                book=order_item["book_id"], order=order, quantity=order_item["quantity"]
+            for book_id, quantity in quantities.items()
+        )
+        expires_at = timezone.now() + timedelta(seconds=settings.STOCK_HOLD_TTL)
+        StockHold.objects.bulk_create(
+            StockHold(
+                book_id=book_id, order=order, quantity=quantity, expires_at=expires_at
             )
-            order_items.append(item)
-            amount += item_sum
-        order.total_price = amount
-        order.save()
+            for book_id, quantity in quantities.items()
+        )
+        get_queue().enqueue("api.mono.create_invoice", order.id, webhook_url)
+    return order
+
 
-    body = {
-        "amount": amount,
+def create_invoice(order_id, webhook_url):
+    order = Order.objects.get(id=order_id, status="pending_invoice")
+    items = list(order.orderitem_set.select_related("book"))
+    hold = StockHold.objects.filter(order=order).first()
+    body = invoice_body(order, items, hold, webhook_url)
+    try:
+        invoice = get_client().create_invoice(body)
+        invoice_id, page_url = invoice["invoiceId"], invoice["pageUrl"]
+    except (MonobankError, KeyError):
+        fail_invoice(order, items)
+        raise
+    Order.objects.filter(id=order.id, status="pending_invoice").update(
+        status="created", invoice_id=invoice_id, page_url=page_url
+    )
+
+
+async def acreate_invoice(order_id, webhook_url):
+    order = await Order.objects.aget(id=order_id, status="pending_invoice")
+    items = [item async for item in order.orderitem_set.select_related("book")]
+    hold = await StockHold.objects.filter(order=order).afirst()
+    body = invoice_body(order, items, hold, webhook_url)
+    try:
+        invoice = await get_async_client().create_invoice(body)
+        invoice_id, page_url = invoice["invoiceId"], invoice["pageUrl"]
+    except (MonobankError, KeyError):
+        await sync_to_async(fail_invoice)(order, items)
+        raise
+    await Order.objects.filter(id=order.id, status="pending_invoice").aupdate(
+        status="created", invoice_id=invoice_id, page_url=page_url
+    )
+
+
+def invoice_body(order, items, hold, webhook_url):
+    validity = settings.STOCK_HOLD_TTL
+    if hold is not None:
+        validity = (hold.expires_at - timezone.now()).total_seconds()
+    return {
+        "amount": order.total_price,
+        "validity": max(int(validity), 60),
         "merchantPaymInfo": {
             "reference": str(order.id),
-            "basketOrder": basketOrder,
+            "basketOrder": [
+                {
+                    "name": item.book.title,
+                    "qty": item.quantity,
+                    "sum": item.price * item.quantity,
+                    "unit": "шт.",
+                }
+                for item in items
+            ],
         },
         "webHookUrl": webhook_url,
     }
-    r = requests.post(
-        "https://api.monobank.ua/api/merchant/invoice/create",
-        headers={"X-Token": settings.MONOBANK_API_KEY},
-        json=body,
+
+
+def fail_invoice(order, items):
+    with transaction.atomic():
+        if Order.objects.filter(id=order.id, status="pending_invoice").update(
+            status="invoice_failed"
+        ):
+            StockHold.objects.filter(order=order).delete()
+            add_stock({item.book_id: item.quantity for item in items})
+
+
+def process_callbacks(batch_size=500):
+    while True:
+        with transaction.atomic():
+            callbacks = list(
+                MonoCallback.objects.select_for_update(skip_locked=True)
+                .filter(processed=False)
+                .order_by("id")[:batch_size]
+            )
+            if not callbacks:
+                return
+            apply_callbacks(callbacks)
+            MonoCallback.objects.filter(
+                id__in=[callback.id for callback in callbacks]
+            ).update(processed=True)
+
+
+def apply_callbacks(callbacks):
+    orders = Order.objects.select_for_update().in_bulk(
+        {c.invoice_id for c in callbacks}, field_name="invoice_id"
     )
-    r.raise_for_status()
-    order.invoice_id = r.json()["invoiceId"]
-    order.save()
-    url = r.json()["pageUrl"]
-    return {"url": url, "id": order.id}
+    changed = {}
+    order_deltas = {}
+    for callback in sorted(callbacks, key=lambda c: c.modified_date):
+        order = orders.get(callback.invoice_id)
+        if order is None or str(order.id) != callback.reference:
+            logger.warning(
+                "Ignoring Monobank callback for unknown invoice %s (reference %s)",
+                callback.invoice_id,
+                callback.reference,
+            )
+            continue
+        if (
+            order.status_modified_at
+            and callback.modified_date <= order.status_modified_at
+        ):
+            continue
+        was_restocked = order.status in RESTOCK_STATUSES
+        order.status = callback.status
+        order.status_modified_at = callback.modified_date
+        changed[order.id] = order
+        # Stock is back on the shelf exactly while the order is in a restock
+        # status, so each order contributes its items at most once per move.
+        direction = (order.status in RESTOCK_STATUSES) - was_restocked
+        order_deltas[order.id] = order_deltas.get(order.id, 0) + direction
+    if not changed:
+        return
+    Order.objects.bulk_update(changed.values(), ["status", "status_modified_at"])
+    # Paid orders keep their stock for good and failed ones get it back below,
+    # either way the holds are settled.
+    StockHold.objects.filter(
+        order_id__in=[
+            order.id
+            for order in changed.values()
+            if order.status == "success" or order.status in RESTOCK_STATUSES
+        ]
+    ).delete()
+    deltas = {}
+    for order_id, book_id, quantity in OrderItem.objects.filter(
+        order_id__in=[order_id for order_id, d in order_deltas.items() if d]
+    ).values_list("order_id", "book_id", "quantity"):
+        deltas[book_id] = deltas.get(book_id, 0) + quantity * order_deltas[order_id]
+    deltas = {book_id: delta for book_id, delta in deltas.items() if delta}
+    if deltas:
+        add_stock(deltas)
+
+
+def load_verifying_key(pub_key_base64):
+    return get_verifier().load_key(base64.b64decode(pub_key_base64))
 
 
-def verify_signature(pub_key_base64, x_sign_base64, body_bytes):
+def verify_signature(pub_key, x_sign_base64, body_bytes):
     try:
-        pub_key_bytes = base64.b64decode(pub_key_base64)
+        if isinstance(pub_key, str):
+            pub_key = load_verifying_key(pub_key)
         signature_bytes = base64.b64decode(x_sign_base64)
-        pub_key = ecdsa.VerifyingKey.from_pem(pub_key_bytes.decode())
-        ok = pub_key.verify(
-            signature_bytes,
-            body_bytes,
-            sigdecode=ecdsa.util.sigdecode_der,
-            hashfunc=hashlib.sha256,
-        )
+        return get_verifier().verify(pub_key, signature_bytes, body_bytes)
     except Exception:
         return False
-    if ok:
+
+
+class VerifyingKeyCache:
+    def __init__(self, ttl, refresh_interval):
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.key = None
+        self.loaded_at = None
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if self.key is None or time.monotonic() - self.loaded_at > self.ttl:
+                self.key = load_verifying_key(MonoSettings.get_token())
+                self.loaded_at = time.monotonic()
+            return self.key
+
+    def refresh(self):
+        with self.lock:
+            now = time.monotonic()
+            # Forged callbacks must not turn into a stream of pubkey requests.
+            if self.refreshed_at and now - self.refreshed_at < self.refresh_interval:
+                return None
+            self.refreshed_at = now
+            try:
+                self.key = load_verifying_key(MonoSettings.refresh_token())
+            except MonobankError:
+                logger.exception("Could not refresh the Monobank public key")
+                return None
+            self.loaded_at = now
+            return self.key
+
+    def clear(self):
+        with self.lock:
+            self.key = self.loaded_at = self.refreshed_at = None
+
+
+key_cache = VerifyingKeyCache(
+    settings.MONOBANK_PUBKEY_TTL, settings.MONOBANK_PUBKEY_REFRESH_INTERVAL
+)
+
+
+def verify_callback(x_sign_base64, body_bytes):
+    if verify_signature(key_cache.get(), x_sign_base64, body_bytes):
         return True
-    else:
-        return False
+    key = key_cache.refresh()
+    return key is not None and verify_signature(key, x_sign_base64, body_bytes)
+
+
+def release_expired_holds(batch_size=500):
+    released = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            now = timezone.now()
+            order_ids = list(
+                StockHold.objects.filter(expires_at__lte=now, order_id__gt=last_id)
+                .order_by("order_id")
+                .values_list("order_id", flat=True)
+                .distinct()[:batch_size]
+            )
+            if not order_ids:
+                return released
+            last_id = order_ids[-1]
+            locked = list(
+                Order.objects.select_for_update(skip_locked=True)
+                .filter(id__in=order_ids)
+                .values_list("id", flat=True)
+            )
+            # Orders paid between the read above and the lock have no holds
+            # left and must keep their status.
+            expired = set(
+                StockHold.objects.filter(
+                    order_id__in=locked, expires_at__lte=now
+                ).values_list("order_id", flat=True)
+            )
+            if not expired:
+                continue
+            holds = StockHold.objects.filter(order_id__in=expired)
+            deltas = {}
+            for book_id, quantity in holds.values_list("book_id", "quantity"):
+                deltas[book_id] = deltas.get(book_id, 0) + quantity
+            holds.delete()
+            # status_modified_at is left alone so a later Monobank callback
+            # still applies over this local expiry.
+            Order.objects.filter(id__in=expired).update(status="expired")
+            add_stock(deltas)
+            released += len(expired)
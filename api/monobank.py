@@ -0,0 +1,253 @@
+import asyncio
+import random
+import threading
+import time
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from api.metrics import MONOBANK_SECONDS, timed
+
+_client = None
+_async_client = None
+
+
+class MonobankError(Exception):
+    pass
+
+
+class CircuitOpenError(MonobankError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError("Monobank is unavailable, circuit is open")
+            # Half-open: let this call probe Monobank and keep the others out
+            # until it reports back.
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class RetryBudget:
+    def __init__(self, ratio=0.2, max_tokens=10):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class MonobankClient:
+    def __init__(
+        self,
+        api_url,
+        token,
+        timeout=(3.05, 10),
+        retries=2,
+        backoff=0.2,
+        pool_size=10,
+        breaker=None,
+        budget=None,
+    ):
+        self.api_url = api_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.budget = budget or RetryBudget()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if token:
+            self.session.headers["X-Token"] = token
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            settings.MONOBANK_API_URL,
+            settings.MONOBANK_API_KEY,
+            timeout=settings.MONOBANK_TIMEOUT,
+            retries=settings.MONOBANK_RETRIES,
+            pool_size=settings.MONOBANK_POOL_SIZE,
+            breaker=CircuitBreaker(
+                settings.MONOBANK_BREAKER_THRESHOLD, settings.MONOBANK_BREAKER_RESET
+            ),
+        )
+
+    def get_pubkey(self):
+        return self.request("GET", "/api/merchant/pubkey", idempotent=True)["key"]
+
+    def create_invoice(self, body):
+        return self.request("POST", "/api/merchant/invoice/create", json=body)
+
+    def request(self, method, path, idempotent=False, **kwargs):
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                with timed("monobank", MONOBANK_SECONDS, endpoint=path):
+                    response = self.session.request(
+                        method, self.api_url + path, timeout=self.timeout, **kwargs
+                    )
+                if response.status_code < 500 and response.status_code != 429:
+                    self.breaker.record_success()
+                    response.raise_for_status()
+                    return response.json()
+                self.breaker.record_failure()
+                error = MonobankError(f"Monobank returned {response.status_code}")
+                # A request that reached Monobank may have been applied.
+                retryable = idempotent
+            except requests.HTTPError as e:
+                raise MonobankError(str(e)) from e
+            except ValueError as e:
+                raise MonobankError("Monobank returned invalid JSON") from e
+            except requests.RequestException as e:
+                self.breaker.record_failure()
+                error = MonobankError(str(e))
+                # Nothing was sent if the connection was never established.
+                retryable = idempotent or isinstance(e, requests.ConnectTimeout)
+            if not retryable or attempt >= self.retries or not self.budget.withdraw():
+                raise error
+            time.sleep(random.uniform(0, self.backoff * 2**attempt))
+            attempt += 1
+
+
+class AsyncMonobankClient:
+    """MonobankClient for the event loop, with the same retry rules."""
+
+    def __init__(
+        self,
+        api_url,
+        token,
+        timeout=(3.05, 10),
+        retries=2,
+        backoff=0.2,
+        pool_size=100,
+        breaker=None,
+        budget=None,
+        transport=None,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.budget = budget or RetryBudget()
+        connect_timeout, read_timeout = timeout
+        self.client = httpx.AsyncClient(
+            base_url=api_url.rstrip("/"),
+            headers={"X-Token": token} if token else {},
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size),
+            transport=transport,
+        )
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            settings.MONOBANK_API_URL,
+            settings.MONOBANK_API_KEY,
+            timeout=settings.MONOBANK_TIMEOUT,
+            retries=settings.MONOBANK_RETRIES,
+            pool_size=settings.MONOBANK_ASYNC_POOL_SIZE,
+            breaker=CircuitBreaker(
+                settings.MONOBANK_BREAKER_THRESHOLD, settings.MONOBANK_BREAKER_RESET
+            ),
+        )
+
+    async def get_pubkey(self):
+        pubkey = await self.request("GET", "/api/merchant/pubkey", idempotent=True)
+        return pubkey["key"]
+
+    async def create_invoice(self, body):
+        return await self.request("POST", "/api/merchant/invoice/create", json=body)
+
+    async def request(self, method, path, idempotent=False, **kwargs):
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                with timed("monobank", MONOBANK_SECONDS, endpoint=path):
+                    response = await self.client.request(method, path, **kwargs)
+                if response.status_code < 500 and response.status_code != 429:
+                    self.breaker.record_success()
+                    response.raise_for_status()
+                    return response.json()
+                self.breaker.record_failure()
+                error = MonobankError(f"Monobank returned {response.status_code}")
+                retryable = idempotent
+            except httpx.HTTPStatusError as e:
+                raise MonobankError(str(e)) from e
+            except ValueError as e:
+                raise MonobankError("Monobank returned invalid JSON") from e
+            except httpx.TransportError as e:
+                self.breaker.record_failure()
+                error = MonobankError(str(e) or type(e).__name__)
+                retryable = idempotent or isinstance(
+                    e, (httpx.ConnectError, httpx.ConnectTimeout)
+                )
+            if not retryable or attempt >= self.retries or not self.budget.withdraw():
+                raise error
+            await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+            attempt += 1
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = MonobankClient.from_settings()
+    return _client
+
+
+def set_client(client):
+    global _client
+    previous, _client = _client, client
+    return previous
+
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncMonobankClient.from_settings()
+    return _async_client
+
+
+def set_async_client(client):
+    global _async_client
+    previous, _async_client = _async_client, client
+    return previous
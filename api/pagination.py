@@ -0,0 +1,120 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework import exceptions
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination that switches to keyset pagination when the
+    `cursor` query parameter is present (empty for the first page).
+    Keyset pages follow the requested ordering with `id` as tie-breaker,
+    are walked forward only and skip the count query.
+    """
+
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.fields = self.get_keyset_fields(queryset)
+        queryset = queryset.order_by(*self.fields)
+        values = self.decode_cursor(request.query_params[self.cursor_query_param])
+        if values is not None:
+            queryset = queryset.filter(self.get_keyset_filter(values))
+
+        results = list(queryset[: self.limit + 1])
+        self.has_next = len(results) > self.limit
+        self.page = results[: self.limit]
+        return self.page
+
+    def get_keyset_fields(self, queryset):
+        ordering = [name for name in queryset.query.order_by if isinstance(name, str)]
+        if not ordering:
+            ordering = list(queryset.model._meta.ordering)
+        self.model_fields = {}
+        for name in ordering:
+            try:
+                field = queryset.model._meta.get_field(name.lstrip("-"))
+            except FieldDoesNotExist:
+                field = None
+            if field is None or field.null:
+                raise exceptions.ValidationError(
+                    f'Ordering by "{name}" is not supported with cursor pagination.'
+                )
+            self.model_fields[field.name] = field
+        if not any(name.lstrip("-") in ("id", "pk") for name in ordering):
+            # Same direction as the leading field so one (field, id) index
+            # serves the whole ordering.
+            ordering.append("-id" if ordering and ordering[0][0] == "-" else "id")
+            self.model_fields["id"] = queryset.model._meta.get_field("id")
+        return ordering
+
+    def get_keyset_filter(self, values):
+        keyset = Q()
+        equal = Q()
+        for name, value in zip(self.fields, values):
+            field = name.lstrip("-")
+            lookup = "lt" if name.startswith("-") else "gt"
+            keyset |= equal & Q(**{f"{field}__{lookup}": value})
+            equal &= Q(**{field: value})
+        return keyset
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.fields):
+                raise ValueError
+            return [
+                self.model_fields[name.lstrip("-")].to_python(value)
+                for name, value in zip(self.fields, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise exceptions.NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, obj):
+        # value_to_string keeps datetimes to the microsecond, which
+        # DjangoJSONEncoder cuts to milliseconds.
+        values = [
+            self.model_fields[name.lstrip("-")].value_to_string(obj)
+            for name in self.fields
+        ]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.offset_query_param
+        )
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.page[-1])
+        )
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(
+            OrderedDict(
+                [
+                    ("next", self.get_next_link()),
+                    ("previous", None),
+                    ("results", data),
+                ]
+            )
+        )
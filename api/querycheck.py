@@ -0,0 +1,186 @@
+import logging
+import re
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+current_check = ContextVar("current_check", default=None)
+repeats_allowed = ContextVar("repeats_allowed", default=False)
+
+PLACEHOLDER_LISTS = re.compile(r"\((?:%s|\?)(?:, (?:%s|\?))*\)")
+NUMBERS = re.compile(r"\b\d+\b")
+IGNORED = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+
+
+class QueryCheckError(AssertionError):
+    pass
+
+
+def normalize(sql):
+    sql = PLACEHOLDER_LISTS.sub("(...)", sql)
+    return NUMBERS.sub("?", sql)
+
+
+def origin():
+    """The innermost frame of project code that issued the current query."""
+    base = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()[:-3]):
+        if (
+            frame.filename.startswith(base)
+            and "site-packages" not in frame.filename
+            and not frame.filename.endswith(("querycheck.py", "metrics.py"))
+        ):
+            return f"{frame.filename[len(base) + 1:]}:{frame.lineno} in {frame.name}"
+    return "unknown"
+
+
+class QueryCheck:
+    def __init__(self, budget=None, label=""):
+        self.budget = budget
+        self.label = label
+        self.queries = []
+
+    def add(self, sql, seconds):
+        if not sql.startswith(IGNORED):
+            self.queries.append(
+                (normalize(sql), seconds, origin(), repeats_allowed.get())
+            )
+
+    def repeated(self):
+        counts = {}
+        for sql, _, where, allowed in self.queries:
+            if not allowed:
+                counts.setdefault((sql, where), 0)
+                counts[(sql, where)] += 1
+        return [
+            (sql, where, count)
+            for (sql, where), count in counts.items()
+            if count >= settings.QUERYCHECK_REPEAT_THRESHOLD
+        ]
+
+    def slow(self):
+        threshold = settings.QUERYCHECK_SLOW_MS / 1000
+        return [
+            (sql, seconds, where)
+            for sql, seconds, where, _ in self.queries
+            if seconds > threshold
+        ]
+
+    def problems(self):
+        problems = [
+            f"{count} similar queries from {where}: {sql}"
+            for sql, where, count in self.repeated()
+        ]
+        problems += [
+            f"slow query ({seconds * 1000:.0f} ms) from {where}: {sql}"
+            for sql, seconds, where in self.slow()
+        ]
+        if self.budget is not None and len(self.queries) > self.budget:
+            problems.append(
+                f"{len(self.queries)} queries over a budget of {self.budget}"
+            )
+        return problems
+
+    def report(self, fail=False):
+        problems = self.problems()
+        if not problems:
+            return
+        message = f"{self.label}: " + "; ".join(problems)
+        if fail:
+            raise QueryCheckError(message)
+        logger.warning(message)
+
+
+def collect_query(execute, sql, params, many, context):
+    check = current_check.get()
+    if check is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        check.add(sql, time.perf_counter() - start)
+
+
+def install_query_collector(connection, **kwargs):
+    if collect_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(collect_query)
+
+
+connection_created.connect(install_query_collector)
+
+
+@contextmanager
+def allow_repeats():
+    """Marks a loop that repeats a query on purpose, like per-batch work."""
+    token = repeats_allowed.set(True)
+    try:
+        yield
+    finally:
+        repeats_allowed.reset(token)
+
+
+@contextmanager
+def check_queries(budget=None, label="block", fail=True):
+    """
+    Flags N+1 patterns, slow queries and more than `budget` queries run
+    inside the block.
+    """
+    for connection in connections.all(initialized_only=True):
+        install_query_collector(connection)
+    check = QueryCheck(budget, label)
+    token = current_check.set(check)
+    try:
+        yield check
+    finally:
+        current_check.reset(token)
+    check.report(fail)
+
+
+class QueryCheckMiddleware:
+    """
+    Enabled with QUERYCHECK. Budgets come from QUERY_BUDGETS by URL name;
+    QUERYCHECK_RAISE turns the logged warnings into errors.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.QUERYCHECK:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with self.check(request) as check:
+            response = self.get_response(request)
+            self.label(request, check)
+        return response
+
+    async def __acall__(self, request):
+        with self.check(request) as check:
+            response = await self.get_response(request)
+            self.label(request, check)
+        return response
+
+    def check(self, request):
+        return check_queries(label=request.path, fail=settings.QUERYCHECK_RAISE)
+
+    def label(self, request, check):
+        match = getattr(request, "resolver_match", None)
+        if match:
+            check.label = f"{request.method} {match.view_name}"
+            check.budget = settings.QUERY_BUDGETS.get(match.view_name)
@@ -0,0 +1,57 @@
+from django.db import connections
+from django.db.models import Q
+from django.db.models.functions import Greatest
+from rest_framework import filters
+
+
+class CatalogueSearchFilter(filters.SearchFilter):
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        if not search_fields or not search_terms:
+            return queryset
+
+        text_fields = [field for field in search_fields if field != "id"]
+        for term in search_terms:
+            condition = Q()
+            for field in text_fields:
+                if "__" in field:
+                    condition |= self.related_condition(queryset.model, field, term)
+                else:
+                    condition |= Q(**{f"{field}__icontains": term})
+            if "id" in search_fields and term.isdigit():
+                condition |= Q(id=int(term))
+            queryset = queryset.filter(condition)
+
+        # Keyset pages need a stable model-field ordering, so they are not ranked.
+        if (
+            connections[queryset.db].vendor == "postgresql"
+            and text_fields
+            and "ordering" not in request.query_params
+            and "cursor" not in request.query_params
+        ):
+            from django.contrib.postgres.search import TrigramSimilarity
+
+            search = " ".join(search_terms)
+            similarities = [TrigramSimilarity(field, search) for field in text_fields]
+            queryset = queryset.annotate(
+                search_rank=Greatest(*similarities)
+                if len(similarities) > 1
+                else similarities[0]
+            ).order_by("-search_rank", "id")
+        return queryset
+
+    def related_condition(self, model, field, term):
+        """
+        Match `field` on a related model by its ids, found with that model's
+        own trigram index first. OR-ing a LIKE across the join would keep
+        Postgres from combining the indexes of both tables.
+        """
+        relation, name = field.split("__", 1)
+        related = model._meta.get_field(relation).related_model
+        ids = list(
+            related.objects.filter(**{f"{name}__icontains": term}).values_list(
+                "pk", flat=True
+            )
+        )
+        return Q(**{f"{relation}__in": ids}) if ids else Q(pk__in=[])
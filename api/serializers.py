@@ -1,20 +1,69 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.utils import timezone
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
-from api.models import Author, Book, Order
+from api.inventory import get_available, set_stock
+from api.metrics import TimedListSerializer, TimedSerializerMixin
+from api.models import Author, AuthorStats, Book, GenreStats, Order, OrderItem
 
 
-class AuthorSerializer(serializers.ModelSerializer):
+class AuthorSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Author
         fields = "__all__"
+        list_serializer_class = TimedListSerializer
 
 
-class BookSerializer(serializers.ModelSerializer):
+class BookSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Book
         fields = "__all__"
+        read_only_fields = ["stock_shards"]
+        list_serializer_class = TimedListSerializer
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.stock_shards and "quantity" in data:
+            # Views that cannot query here pass the totals in the context.
+            available = self.context.get("available") or get_available([instance])
+            data["quantity"] = available[instance.id]
+        return data
+
+    def update(self, instance, validated_data):
+        if instance.stock_shards and "quantity" in validated_data:
+            set_stock(instance, validated_data.pop("quantity"))
+        return super().update(instance, validated_data)
+
+
+class BookWithAuthorSerializer(BookSerializer):
+    author = AuthorSerializer(read_only=True)
+
+
+class AuthorBookSerializer(BookSerializer):
+    class Meta:
+        model = Book
+        exclude = ["author"]
+
+
+class AuthorWithBooksSerializer(AuthorSerializer):
+    books = AuthorBookSerializer(source="book_set", many=True, read_only=True)
+    books_count = serializers.IntegerField(read_only=True)
+
+
+class BookImportSerializer(serializers.Serializer):
+    isbn = serializers.CharField(
+        max_length=20, required=False, allow_null=True, allow_blank=True
+    )
+    title = serializers.CharField(max_length=100)
+    author = serializers.CharField(max_length=100)
+    genre = serializers.CharField(max_length=100)
+    publication_date = serializers.DateField()
+    price = serializers.IntegerField(min_value=0)
+    quantity = serializers.IntegerField()
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -54,18 +103,96 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 
 
 class OrderContentSerializer(serializers.Serializer):
-    book_id = serializers.PrimaryKeyRelatedField(queryset=Book.objects.all())
-    quantity = serializers.IntegerField()
+    book_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
 
 
 class OrderSerializer(serializers.Serializer):
     order = OrderContentSerializer(many=True, allow_empty=False)
 
+    def validate_order(self, value):
+        books = Book.objects.in_bulk({item["book_id"] for item in value})
+        for item in value:
+            try:
+                item["book_id"] = books[item["book_id"]]
+            except KeyError:
+                raise serializers.ValidationError(
+                    f'Invalid pk "{item["book_id"]}" - object does not exist.'
+                )
+        return value
+
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    book_id = serializers.IntegerField()
+    title = serializers.CharField(source="book.title")
+    price = serializers.SerializerMethodField()
+
+    class Meta:
+        model = OrderItem
+        fields = ["book_id", "title", "price", "quantity"]
+
+    def get_price(self, item):
+        return item.book.price if item.price is None else item.price
+
+
+class OrderModelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    books = serializers.SerializerMethodField()
+    items = OrderItemSerializer(source="orderitem_set", many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = [
+            "total_price",
+            "created_at",
+            "invoice_id",
+            "id",
+            "books",
+            "items",
+            "status",
+        ]
+        list_serializer_class = TimedListSerializer
+
+    def get_books(self, order):
+        return [item.book_id for item in order.orderitem_set.all()]
+
+
+class OrderStatusSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    url = serializers.CharField(source="page_url")
 
-class OrderModelSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
-        fields = ["total_price", "created_at", "invoice_id", "id", "books", "status"]
+        fields = ["id", "status", "invoice_id", "url"]
+
+
+class AuthorStatsSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(source="author.name")
+
+    class Meta:
+        model = AuthorStats
+        fields = ["author", "name", "book_count", "stock_quantity", "stock_value"]
+
+
+class GenreStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = GenreStats
+        fields = ["genre", "book_count", "stock_quantity", "stock_value"]
+
+
+class SalesQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    top = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+    def validate(self, attrs):
+        end = attrs.get("end") or timezone.localdate()
+        start = attrs.get("start") or end - timedelta(days=29)
+        if start > end:
+            raise serializers.ValidationError("start must not be after end.")
+        if (end - start).days >= settings.ANALYTICS_MAX_DAYS:
+            raise serializers.ValidationError(
+                f"The range may span at most {settings.ANALYTICS_MAX_DAYS} days."
+            )
+        return {**attrs, "start": start, "end": end}
 
 
 class MonoCallbackSerializer(serializers.Serializer):
@@ -74,3 +201,4 @@ class MonoCallbackSerializer(serializers.Serializer):
     amount = serializers.IntegerField()
     ccy = serializers.IntegerField()
     reference = serializers.CharField()
+    modifiedDate = serializers.DateTimeField(required=False)
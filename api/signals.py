@@ -0,0 +1,60 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from api.authentication import user_states
+from api.cache import bump_catalogue_version
+from api.models import Author, AuthorStats, Book
+from api.stats import book_change, book_state, queue_stats, stored_book_state
+from api.stockgate import get_stock_gate
+
+
+@receiver([post_save, post_delete], sender=Book)
+@receiver([post_save, post_delete], sender=Author)
+def invalidate_catalogue(sender, **kwargs):
+    bump_catalogue_version()
+
+
+@receiver(post_save, sender=Book)
+def update_stock_gate(sender, instance, **kwargs):
+    gate = get_stock_gate()
+    if gate is not None and not instance.stock_shards:
+        levels = {instance.id: instance.quantity}
+        transaction.on_commit(lambda: gate.set_levels(levels))
+
+
+@receiver(pre_save, sender=Book)
+def remember_book_state(sender, instance, raw=False, **kwargs):
+    new = raw or instance.id is None
+    instance._stats_state = None if new else stored_book_state(instance.id)
+
+
+@receiver(post_save, sender=Book)
+def update_book_stats(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = instance._stats_state
+    # Saving a sharded book leaves its shards, and so its stock, alone.
+    quantity = old[3] if old and instance.stock_shards else instance.quantity
+    changes = [
+        book_change((instance.author_id, instance.genre, instance.price, quantity))
+    ]
+    if old is not None:
+        changes.append(book_change(old, -1))
+    queue_stats(changes)
+
+
+@receiver(pre_delete, sender=Book)
+def remove_book_stats(sender, instance, **kwargs):
+    queue_stats([book_change(book_state(instance), -1)])
+
+
+@receiver(post_delete, sender=Author)
+def remove_author_stats(sender, instance, **kwargs):
+    AuthorStats.objects.filter(author_id=instance.id).delete()
+
+
+@receiver([post_save, post_delete], sender=User)
+def forget_user_state(sender, instance, **kwargs):
+    user_states.discard(instance.id)
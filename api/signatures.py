@@ -0,0 +1,53 @@
+import hashlib
+
+import ecdsa
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives.serialization import load_pem_public_key
+except ImportError:
+    load_pem_public_key = None
+
+_verifiers = {}
+
+
+class CryptographyVerifier:
+    def load_key(self, pem):
+        return load_pem_public_key(pem)
+
+    def verify(self, key, signature, body):
+        try:
+            key.verify(signature, body, ec.ECDSA(hashes.SHA256()))
+        except InvalidSignature:
+            return False
+        return True
+
+
+class EcdsaVerifier:
+    def load_key(self, pem):
+        return ecdsa.VerifyingKey.from_pem(pem.decode())
+
+    def verify(self, key, signature, body):
+        try:
+            return key.verify(
+                signature,
+                body,
+                sigdecode=ecdsa.util.sigdecode_der,
+                hashfunc=hashlib.sha256,
+            )
+        except ecdsa.BadSignatureError:
+            return False
+
+
+def get_verifier():
+    path = settings.MONOBANK_SIGNATURE_BACKEND
+    if path not in _verifiers:
+        verifier_class = import_string(path)
+        if verifier_class is CryptographyVerifier and load_pem_public_key is None:
+            verifier_class = EcdsaVerifier
+        _verifiers[path] = verifier_class()
+    return _verifiers[path]
@@ -0,0 +1,141 @@
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, Count, F, Q, Sum, When
+
+from api.models import Author, AuthorStats, Book, GenreStats, StockShard
+from api.tasks import get_queue
+
+FIELDS = ("book_count", "stock_quantity", "stock_value")
+
+
+def shard_stock(book_id):
+    total = StockShard.objects.filter(book_id=book_id).aggregate(Sum("quantity"))
+    return total["quantity__sum"] or 0
+
+
+def book_state(book):
+    """(author_id, genre, price, stock) of a loaded book."""
+    quantity = shard_stock(book.id) if book.stock_shards else book.quantity
+    return book.author_id, book.genre, book.price, quantity
+
+
+def stored_book_state(book_id):
+    book = (
+        Book.objects.only("author_id", "genre", "price", "quantity", "stock_shards")
+        .filter(id=book_id)
+        .first()
+    )
+    return None if book is None else book_state(book)
+
+
+def book_change(state, sign=1):
+    author_id, genre, price, quantity = state
+    return [author_id, genre, sign, sign * quantity, sign * quantity * price]
+
+
+def queue_stats(changes):
+    """
+    Queue `changes`, lists of [author_id, genre, books, quantity, value]
+    deltas, so requests never wait on the hot author and genre rows.
+    """
+    totals = {}
+    for author_id, genre, *deltas in changes:
+        group = totals.setdefault((author_id, genre), [0, 0, 0])
+        for i, delta in enumerate(deltas):
+            group[i] += delta
+    changes = [[*key, *deltas] for key, deltas in totals.items() if any(deltas)]
+    if changes:
+        get_queue().enqueue("api.stats.apply_stats", changes)
+
+
+def record_stock_movement(deltas, books):
+    """Queue the statistics for `deltas` ({book_id: quantity}) of `books`."""
+    changes = []
+    for book_id, delta in deltas.items():
+        book = books[book_id]
+        changes.append([book.author_id, book.genre, 0, delta, delta * book.price])
+    queue_stats(changes)
+
+
+def apply_stats(changes):
+    authors, genres = {}, {}
+    for author_id, genre, *deltas in changes:
+        for groups, key in ((authors, author_id), (genres, genre)):
+            totals = groups.setdefault(key, [0, 0, 0])
+            for i, delta in enumerate(deltas):
+                totals[i] += delta
+    # Deleted authors have their row removed already; do not bring it back.
+    existing = Author.objects.filter(id__in=authors).values_list("id", flat=True)
+    authors = {author_id: authors[author_id] for author_id in existing}
+    with transaction.atomic():
+        update_stats(AuthorStats, "author_id", authors)
+        update_stats(GenreStats, "genre", genres)
+
+
+def update_stats(model, key_field, deltas):
+    deltas = {key: totals for key, totals in deltas.items() if any(totals)}
+    if not deltas:
+        return
+    model.objects.bulk_create(
+        [model(**{key_field: key}) for key in sorted(deltas)], ignore_conflicts=True
+    )
+    model.objects.filter(**{f"{key_field}__in": deltas}).update(
+        **{
+            field: Case(
+                *(
+                    When(**{key_field: key}, then=F(field) + totals[i])
+                    for key, totals in deltas.items()
+                ),
+                default=F(field),
+                output_field=model._meta.get_field(field),
+            )
+            for i, field in enumerate(FIELDS)
+        }
+    )
+
+
+def group_totals(key):
+    """{key: [books, quantity, value]} over all books, grouped by Book `key`."""
+    totals = {}
+    unsharded = Q(stock_shards=0)
+    for group, books, quantity, value in (
+        Book.objects.values(key)
+        .annotate(
+            books=Count("id"),
+            stock=Sum("quantity", filter=unsharded),
+            value=Sum(
+                F("quantity") * F("price"),
+                filter=unsharded,
+                output_field=BigIntegerField(),
+            ),
+        )
+        .values_list(key, "books", "stock", "value")
+    ):
+        totals[group] = [books, quantity or 0, value or 0]
+    for group, quantity, value in (
+        StockShard.objects.values(f"book__{key}")
+        .annotate(
+            stock=Sum("quantity"),
+            value=Sum(F("quantity") * F("book__price"), output_field=BigIntegerField()),
+        )
+        .values_list(f"book__{key}", "stock", "value")
+    ):
+        totals[group][1] += quantity
+        totals[group][2] += value
+    return totals
+
+
+def rebuild_stats():
+    """Recompute all statistics from the books and their stock shards."""
+    authors = group_totals("author_id")
+    genres = group_totals("genre")
+    with transaction.atomic():
+        AuthorStats.objects.all().delete()
+        GenreStats.objects.all().delete()
+        for model, key_field, totals in (
+            (AuthorStats, "author_id", authors),
+            (GenreStats, "genre", genres),
+        ):
+            model.objects.bulk_create(
+                model(**{key_field: key}, **dict(zip(FIELDS, values)))
+                for key, values in totals.items()
+            )
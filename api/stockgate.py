@@ -0,0 +1,212 @@
+import logging
+import threading
+
+import redis
+from django.conf import settings
+from django.db.models import Sum
+from django.utils.module_loading import import_string
+
+from api.models import Book, StockShard
+
+logger = logging.getLogger(__name__)
+
+_gates = {}
+
+# All keys share the {stock} hash tag so a basket stays in one cluster slot.
+TAKE_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    local stock = redis.call("GET", key)
+    if not stock then
+        return -1
+    end
+    if tonumber(stock) < tonumber(ARGV[i]) then
+        return 0
+    end
+end
+for i, key in ipairs(KEYS) do
+    redis.call("DECRBY", key, ARGV[i])
+end
+return 1
+"""
+
+ADD_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    if redis.call("EXISTS", key) == 1 then
+        redis.call("INCRBY", key, ARGV[i])
+    end
+end
+"""
+
+COMPARE_AND_SET_SCRIPT = """
+if (redis.call("GET", KEYS[1]) or "") ~= ARGV[1] then
+    return 0
+end
+redis.call("SET", KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def book_id_batches(batch_size=1000):
+    batch = []
+    for book_id in (
+        Book.objects.order_by("id")
+        .values_list("id", flat=True)
+        .iterator(chunk_size=batch_size)
+    ):
+        batch.append(book_id)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stock_levels(book_ids):
+    shard_totals = dict(
+        StockShard.objects.filter(book_id__in=book_ids)
+        .values("book_id")
+        .annotate(total=Sum("quantity"))
+        .values_list("book_id", "total")
+    )
+    return {
+        book_id: shard_totals.get(book_id, 0) if shards else quantity
+        for book_id, quantity, shards in Book.objects.filter(
+            id__in=book_ids
+        ).values_list("id", "quantity", "stock_shards")
+    }
+
+
+class StockGate:
+    """
+    Mirror of the stock levels that turns away baskets the database would
+    reject anyway. The database stays authoritative: `take` returns None
+    when the mirror does not know a book (or is unreachable) and the order
+    goes through to the database unchecked.
+    """
+
+    def reconcile(self, batch_size=1000):
+        corrected = 0
+        for book_ids in book_id_batches(batch_size):
+            # The mirror is read before the database: a change that lands in
+            # between makes the compare-and-set fail instead of being undone.
+            current = self.get_levels(book_ids)
+            levels = stock_levels(book_ids)
+            for book_id, level in levels.items():
+                if current[book_id] != level and self.compare_and_set(
+                    book_id, current[book_id], level
+                ):
+                    corrected += 1
+        return corrected
+
+
+class LocalStockGate(StockGate):
+    def __init__(self):
+        self.stock = {}
+        self.lock = threading.Lock()
+
+    def take(self, quantities):
+        with self.lock:
+            if any(book_id not in self.stock for book_id in quantities):
+                return None
+            if any(self.stock[k] < v for k, v in quantities.items()):
+                return False
+            for book_id, quantity in quantities.items():
+                self.stock[book_id] -= quantity
+            return True
+
+    def add(self, deltas):
+        with self.lock:
+            for book_id, delta in deltas.items():
+                if book_id in self.stock:
+                    self.stock[book_id] += delta
+
+    def set_levels(self, levels):
+        with self.lock:
+            self.stock.update(levels)
+
+    def get_levels(self, book_ids):
+        with self.lock:
+            return {book_id: self.stock.get(book_id) for book_id in book_ids}
+
+    def compare_and_set(self, book_id, expected, level):
+        with self.lock:
+            if self.stock.get(book_id) != expected:
+                return False
+            self.stock[book_id] = level
+            return True
+
+
+class RedisStockGate(StockGate):
+    def __init__(self, client=None):
+        self.redis = client or redis.Redis.from_url(
+            settings.STOCK_GATE_REDIS_URL,
+            socket_timeout=settings.STOCK_GATE_TIMEOUT,
+            socket_connect_timeout=settings.STOCK_GATE_TIMEOUT,
+        )
+        self.take_script = self.redis.register_script(TAKE_SCRIPT)
+        self.add_script = self.redis.register_script(ADD_SCRIPT)
+        self.compare_and_set_script = self.redis.register_script(COMPARE_AND_SET_SCRIPT)
+
+    def key(self, book_id):
+        return f"{{stock}}:{book_id}"
+
+    def take(self, quantities):
+        try:
+            result = self.take_script(
+                keys=[self.key(book_id) for book_id in quantities],
+                args=list(quantities.values()),
+            )
+        except redis.RedisError:
+            logger.warning("Stock gate unavailable", exc_info=True)
+            return None
+        return None if result == -1 else bool(result)
+
+    def add(self, deltas):
+        try:
+            self.add_script(
+                keys=[self.key(book_id) for book_id in deltas],
+                args=list(deltas.values()),
+            )
+        except redis.RedisError:
+            logger.warning("Stock gate unavailable", exc_info=True)
+
+    def set_levels(self, levels):
+        try:
+            self.redis.mset({self.key(k): v for k, v in levels.items()})
+        except redis.RedisError:
+            logger.warning("Stock gate unavailable", exc_info=True)
+
+    def get_levels(self, book_ids):
+        book_ids = list(book_ids)
+        values = self.redis.mget([self.key(book_id) for book_id in book_ids])
+        return {
+            book_id: None if value is None else int(value)
+            for book_id, value in zip(book_ids, values)
+        }
+
+    def compare_and_set(self, book_id, expected, level):
+        return bool(
+            self.compare_and_set_script(
+                keys=[self.key(book_id)],
+                args=["" if expected is None else expected, level],
+            )
+        )
+
+
+def get_stock_gate():
+    path = settings.STOCK_GATE
+    if not path:
+        return None
+    if path not in _gates:
+        _gates[path] = import_string(path)()
+    return _gates[path]
+
+
+def reconcile_stock_gate():
+    gate = get_stock_gate()
+    if gate is None:
+        return 0
+    corrected = gate.reconcile()
+    if corrected:
+        logger.info("Stock gate corrected for %d books", corrected)
+    return corrected
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+from api.models import Task
+
+logger = logging.getLogger(__name__)
+
+_queues = {}
+
+
+def run_task(name, *args):
+    try:
+        import_string(name)(*args)
+    except Exception:
+        logger.exception("Task %s%r failed", name, args)
+
+
+class InProcessQueue:
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.TASK_QUEUE_WORKERS, thread_name_prefix="tasks"
+        )
+
+    def enqueue(self, name, *args):
+        transaction.on_commit(lambda: self.executor.submit(self._run, name, args))
+
+    def _run(self, name, args):
+        try:
+            run_task(name, *args)
+        finally:
+            connection.close()
+
+
+class AsyncioQueue(InProcessQueue):
+    """
+    Runs tasks on an event loop in a background thread, so invoices waiting
+    on Monobank do not hold a thread each. A task `module.name` runs its
+    coroutine twin `module.aname` when there is one and falls back to the
+    thread pool otherwise.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(
+            target=self.loop.run_forever, name="tasks-loop", daemon=True
+        ).start()
+
+    def enqueue(self, name, *args):
+        transaction.on_commit(
+            lambda: asyncio.run_coroutine_threadsafe(
+                self._run_async(name, args), self.loop
+            )
+        )
+
+    async def _run_async(self, name, args):
+        module, _, function = name.rpartition(".")
+        try:
+            task = import_string(f"{module}.a{function}")
+        except ImportError:
+            await self.loop.run_in_executor(self.executor, self._run, name, args)
+            return
+        try:
+            await task(*args)
+        except Exception:
+            logger.exception("Task %s%r failed", name, args)
+
+
+class DatabaseQueue:
+    def enqueue(self, name, *args):
+        Task.objects.create(name=name, args=list(args))
+
+    def run_pending(self, batch_size=100):
+        # Tasks are claimed and deleted before they run, so a crashed worker
+        # drops them instead of creating a second invoice for the same order.
+        with transaction.atomic():
+            tasks = list(
+                Task.objects.select_for_update(skip_locked=True).order_by("id")[
+                    :batch_size
+                ]
+            )
+            Task.objects.filter(id__in=[task.id for task in tasks]).delete()
+        for task in tasks:
+            run_task(task.name, *task.args)
+        return len(tasks)
+
+
+def get_queue():
+    path = settings.TASK_QUEUE
+    if path not in _queues:
+        _queues[path] = import_string(path)()
+    return _queues[path]
@@ -1,11 +1,118 @@
+import base64
+import hashlib
+import io
+import itertools
+import json
+import time
+from datetime import timedelta
+from unittest import mock
+
+import ecdsa
+import fakeredis
+import httpx
 import pytest
+import requests
+from asgiref.sync import async_to_sync
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import AsyncRequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 from rest_framework_simplejwt.tokens import AccessToken
 
-from api.models import Book, Author
+from api import analytics, stockgate, views
+from api.authentication import user_states
+from api.cache import get_catalogue_version
+from api.hashers import HashingPool
+from api.metrics import MONOBANK_SECONDS, request_timings
+from api.querycheck import QueryCheckError, allow_repeats, check_queries
+from api.models import (
+    Book,
+    Author,
+    AuthorStats,
+    GenreStats,
+    MonoCallback,
+    MonoSettings,
+    Order,
+    OrderItem,
+    StockHold,
+    StockShard,
+    Task,
+)
+from api.inventory import add_stock, get_available, set_stock, sync_sharded_stock
+from api.mono import (
+    acreate_invoice,
+    key_cache,
+    process_callbacks,
+    release_expired_holds,
+    verify_callback,
+    verify_signature,
+)
+from api.monobank import (
+    AsyncMonobankClient,
+    CircuitBreaker,
+    CircuitOpenError,
+    MonobankClient,
+    MonobankError,
+    set_async_client,
+    set_client,
+)
+from api.stockgate import RedisStockGate, _gates, get_stock_gate
+from api.tasks import DatabaseQueue
+from api.throttling import AuthIPThrottle
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    user_states.clear()
+
+
+# Most queries any test makes through each endpoint; sharded stock and
+# cascades account for the larger ones.
+QUERY_BUDGETS = {
+    "home": 0,
+    # Count, page and one shard total lookup however many books are sharded,
+    # or one author lookup per search term.
+    "book-list": 4,
+    "book-detail": 2,
+    "book-create": 3,
+    "book-import": 8,
+    "book-export": 2,
+    "book-update": 5,
+    "book-delete": 6,
+    "user-register": 2,
+    "token_obtain_pair": 2,
+    "authors-create": 2,
+    # Count, authors, prefetched books and their shard totals.
+    "author-list": 4,
+    "author-detail": 3,
+    "author-update": 3,
+    "author-delete": 5,
+    "order-create": 12,
+    "order-status": 1,
+    "mono_callback": 3,
+    "order-list": 3,
+    "order-export": 1,
+    "catalogue-stats": 1,
+    "author-stats": 2,
+    "sales-analytics": 7,
+    "sales-chart": 7,
+    "metrics": 0,
+}
+
+
+@pytest.fixture(autouse=True)
+def query_budgets(settings):
+    settings.QUERYCHECK = True
+    settings.QUERYCHECK_RAISE = True
+    settings.QUERY_BUDGETS = QUERY_BUDGETS
 
 
 @pytest.fixture
@@ -98,6 +205,298 @@ class TestBookAPIViews:
         assert Book.objects.count() == 0
 
 
+@pytest.mark.django_db
+class TestCatalogueCache:
+    def test_list_is_cached(self, api_client, book, django_assert_num_queries):
+        url = reverse("book-list")
+        first = api_client.get(url, {"ordering": "-price", "limit": 5})
+        with django_assert_num_queries(0):
+            second = api_client.get(url, {"limit": 5, "ordering": "-price"})
+        assert second.data == first.data
+        assert second["ETag"] == first["ETag"]
+
+    def test_if_none_match(self, api_client, book):
+        url = reverse("book-detail", kwargs={"pk": book.pk})
+        etag = api_client.get(url)["ETag"]
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response["ETag"] == etag
+
+    def test_checkout_keeps_pages_but_updates_stock(
+        self,
+        api_client,
+        monobank,
+        task_queue,
+        books,
+        django_capture_on_commit_callbacks,
+        django_assert_num_queries,
+    ):
+        url = reverse("author-list")
+        etag = api_client.get(url, {"expand": "books"})["ETag"]
+        version = get_catalogue_version()
+        data = {"order": [{"book_id": books[0].id, "quantity": 2}]}
+        with django_capture_on_commit_callbacks(execute=True):
+            api_client.post(reverse("order-create"), data, format="json")
+        assert get_catalogue_version() == version
+        # The page comes from the cache; only the stock of its books is read.
+        with django_assert_num_queries(1):
+            response = api_client.get(url, {"expand": "books"})
+        assert response["ETag"] != etag
+        quantities = [b["quantity"] for b in response.data["results"][0]["books"]]
+        assert quantities == [3, 5, 5, 5, 5]
+        assert api_client.get(url, {"expand": "books"})["ETag"] == response["ETag"]
+
+    def test_write_invalidates_cache(
+        self, authenticated_client, book, django_capture_on_commit_callbacks
+    ):
+        url = reverse("book-list")
+        etag = authenticated_client.get(url)["ETag"]
+        with django_capture_on_commit_callbacks(execute=True):
+            authenticated_client.delete(reverse("book-delete", kwargs={"pk": book.pk}))
+        response = authenticated_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["count"] == 0
+
+
+@pytest.mark.django_db
+class TestBookImport:
+    def test_import_csv(self, authenticated_client, book):
+        book.isbn = "978-0"
+        book.save()
+        body = (
+            "isbn,title,author,genre,publication_date,price,quantity\n"
+            "978-0,Book 1 revised,John Doe,Fiction,2022-01-01,1200,3\n"
+            "978-1,New Book,Jane Roe,Poetry,2023-02-01,500,7\n"
+            ",No Isbn,Jane Roe,Poetry,2023-02-01,300,1\n"
+            "978-2,Broken,Jane Roe,Poetry,not a date,-1,1\n"
+        )
+        response = authenticated_client.post(
+            reverse("book-import"), body, content_type="text/csv"
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["created"] == 2
+        assert response.data["updated"] == 1
+        assert [e["row"] for e in response.data["errors"]] == [4]
+        assert set(response.data["errors"][0]["errors"]) == {
+            "publication_date",
+            "price",
+        }
+        book.refresh_from_db()
+        assert (book.title, book.price, book.quantity) == ("Book 1 revised", 1200, 3)
+        assert Author.objects.filter(name="Jane Roe").count() == 1
+        assert Book.objects.get(isbn="978-1").author.name == "Jane Roe"
+        assert Book.objects.count() == 3
+
+    def test_repeated_isbn_is_reported(self, authenticated_client, author):
+        body = (
+            "isbn,title,author,genre,publication_date,price,quantity\n"
+            "978-1,First,John Doe,Fiction,2022-01-01,500,7\n"
+            "978-2,Other,John Doe,Fiction,2022-01-01,500,7\n"
+            "978-1,Second,John Doe,Fiction,2022-01-01,500,2\n"
+        )
+        response = authenticated_client.post(
+            reverse("book-import"), body, content_type="text/csv"
+        )
+        assert response.data["created"] == 2
+        assert response.data["errors"] == [
+            {"row": 1, "errors": "Superseded by row 3 with the same ISBN"}
+        ]
+        assert Book.objects.get(isbn="978-1").title == "Second"
+
+    def test_import_ndjson_in_batches(
+        self, authenticated_client, author, django_assert_max_num_queries
+    ):
+        lines = [
+            json.dumps(
+                {
+                    "isbn": f"isbn-{i}",
+                    "title": f"Book {i}",
+                    "author": author.name,
+                    "genre": "Fiction",
+                    "publication_date": "2022-01-01",
+                    "price": 100,
+                    "quantity": i,
+                }
+            )
+            for i in range(50)
+        ]
+        lines.insert(10, "{not json")
+        with django_assert_max_num_queries(20):
+            response = authenticated_client.post(
+                reverse("book-import") + "?batch_size=20",
+                "\n".join(lines),
+                content_type="application/x-ndjson",
+            )
+        assert response.data["created"] == 50
+        assert response.data["errors"] == [{"row": 11, "errors": "Invalid JSON"}]
+        assert Book.objects.get(isbn="isbn-49").quantity == 49
+
+    def test_import_books_command(self, tmp_path, author):
+        path = tmp_path / "books.csv"
+        path.write_text(
+            "isbn,title,author,genre,publication_date,price,quantity\n"
+            "978-1,New Book,John Doe,Poetry,2023-02-01,500,7\n"
+        )
+        out = io.StringIO()
+        call_command("import_books", str(path), stdout=out)
+        assert json.loads(out.getvalue())["created"] == 1
+        assert Book.objects.get(isbn="978-1").author == author
+
+    def test_import_requires_authentication(self, api_client):
+        response = api_client.post(reverse("book-import"), "", content_type="text/csv")
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_import_unsupported_format(self, authenticated_client):
+        response = authenticated_client.post(reverse("book-import"), {}, format="json")
+        assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+
+@pytest.mark.django_db
+class TestCatalogueExpand:
+    def create_books(self, authors, per_author):
+        for i in range(authors):
+            author = Author.objects.create(name=f"Author {i}")
+            for j in range(per_author):
+                Book.objects.create(
+                    title=f"Book {i}.{j}",
+                    author=author,
+                    genre="Fiction",
+                    publication_date="2022-01-01",
+                    price=100,
+                    quantity=1,
+                )
+
+    @pytest.mark.parametrize("sharded", [1, 6])
+    def test_authors_expand_sharded_books(
+        self, api_client, sharded, django_assert_num_queries
+    ):
+        self.create_books(2, 3)
+        for book in Book.objects.order_by("id")[:sharded]:
+            set_stock(book, 4, 2)
+        with django_assert_num_queries(4):
+            response = api_client.get(reverse("author-list"), {"expand": "books"})
+        quantities = [
+            book["quantity"]
+            for author in response.data["results"]
+            for book in author["books"]
+        ]
+        assert quantities == [4] * sharded + [1] * (6 - sharded)
+
+    def test_author_detail_expand_sharded_books(
+        self, api_client, django_assert_num_queries
+    ):
+        self.create_books(1, 3)
+        author = Author.objects.get()
+        for book in Book.objects.all():
+            set_stock(book, 4, 2)
+        url = reverse("author-detail", kwargs={"pk": author.pk})
+        with django_assert_num_queries(3):
+            response = api_client.get(url, {"expand": "books"})
+        assert [book["quantity"] for book in response.data["books"]] == [4, 4, 4]
+
+    @pytest.mark.parametrize("authors", [1, 5])
+    def test_books_expand_author(self, api_client, authors, django_assert_num_queries):
+        self.create_books(authors, 2)
+        with django_assert_num_queries(2):
+            response = api_client.get(reverse("book-list"), {"expand": "author"})
+        book = response.data["results"][0]
+        assert book["author"] == {"id": book["author"]["id"], "name": "Author 0"}
+
+    @pytest.mark.parametrize("authors", [1, 5])
+    def test_authors_expand_books(self, api_client, authors, django_assert_num_queries):
+        self.create_books(authors, 3)
+        with django_assert_num_queries(3):
+            response = api_client.get(reverse("author-list"), {"expand": "books"})
+        author = response.data["results"][0]
+        assert author["books_count"] == 3
+        assert [b["title"] for b in author["books"]] == [
+            "Book 0.0",
+            "Book 0.1",
+            "Book 0.2",
+        ]
+
+    def test_author_detail_expand_books(self, api_client, book):
+        url = reverse("author-detail", kwargs={"pk": book.author_id})
+        response = api_client.get(url, {"expand": "books"})
+        assert response.data["books_count"] == 1
+        assert response.data["books"][0]["id"] == book.id
+        assert "books" not in api_client.get(url).data
+
+
+@pytest.mark.django_db
+class TestCatalogueSearch:
+    def test_search_title_genre_and_author(self, api_client, book):
+        url = reverse("book-list")
+        for term in ("book", "fict", "doe", "john book"):
+            response = api_client.get(url, {"search": term})
+            assert [b["id"] for b in response.data["results"]] == [book.id]
+        assert api_client.get(url, {"search": "mystery"}).data["count"] == 0
+
+    def test_author_match_does_not_join(self, api_client, book):
+        with CaptureQueriesContext(connection) as queries:
+            response = api_client.get(reverse("book-list"), {"search": "doe"})
+        assert [b["id"] for b in response.data["results"]] == [book.id]
+        book_queries = [q["sql"] for q in queries if 'FROM "api_book"' in q["sql"]]
+        assert book_queries
+        assert not any("api_author" in sql for sql in book_queries)
+
+    def test_search_by_id_is_exact(self, api_client, author):
+        books = [
+            Book.objects.create(
+                title="Untitled",
+                author=author,
+                genre="Poetry",
+                publication_date="2022-01-01",
+                price=1,
+                quantity=1,
+            )
+            for _ in range(12)
+        ]
+        response = api_client.get(reverse("book-list"), {"search": str(books[0].id)})
+        assert [b["id"] for b in response.data["results"]] == [books[0].id]
+
+
+@pytest.mark.django_db
+class TestKeysetPagination:
+    def test_walk_pages(self, api_client, author, django_assert_num_queries):
+        for i in range(7):
+            Book.objects.create(
+                title=f"Book {i}",
+                author=author,
+                genre="Fiction",
+                publication_date="2022-01-01",
+                price=100 * (i % 3),
+                quantity=1,
+            )
+        expected = list(
+            Book.objects.order_by("-price", "-id").values_list("id", flat=True)
+        )
+        url = reverse("book-list") + "?ordering=-price&limit=3&cursor="
+        ids = []
+        while url:
+            with django_assert_num_queries(1):
+                response = api_client.get(url)
+            assert response.status_code == status.HTTP_200_OK
+            assert "count" not in response.data
+            ids += [book["id"] for book in response.data["results"]]
+            url = response.data["next"]
+        assert ids == expected
+
+    def test_offset_pagination_is_default(self, api_client, book):
+        response = api_client.get(reverse("book-list"))
+        assert response.data["count"] == 1
+
+    def test_invalid_cursor(self, api_client, book):
+        response = api_client.get(reverse("book-list"), {"cursor": "garbage"})
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_nullable_ordering_rejected(self, api_client):
+        response = api_client.get(
+            reverse("order-list"), {"cursor": "", "ordering": "status"}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
 @pytest.mark.django_db
 class TestAuthorAPIViews:
     def test_get_all_authors(self, authenticated_client, author):
@@ -136,3 +535,1288 @@ class TestAuthorAPIViews:
         response = authenticated_client.delete(url)
         assert response.status_code == status.HTTP_204_NO_CONTENT
         assert Author.objects.count() == 0
+
+
+@pytest.fixture
+def monobank():
+    client = mock.Mock(spec=MonobankClient)
+    invoices = itertools.count(1)
+
+    def create_invoice(body):
+        invoice_id = f"inv-{next(invoices)}"
+        return {
+            "invoiceId": invoice_id,
+            "pageUrl": f"https://pay.mbnk.biz/{invoice_id}",
+        }
+
+    client.create_invoice.side_effect = create_invoice
+    previous = set_client(client)
+    yield client
+    set_client(previous)
+
+
+@pytest.fixture
+def task_queue(settings):
+    settings.TASK_QUEUE = "api.tasks.DatabaseQueue"
+    return DatabaseQueue()
+
+
+@pytest.fixture
+def books(author):
+    return [
+        Book.objects.create(
+            title=f"Book {i}",
+            author=author,
+            genre="Fiction",
+            publication_date="2022-01-01",
+            price=100 * i,
+            quantity=5,
+        )
+        for i in range(1, 6)
+    ]
+
+
+@pytest.mark.django_db
+class TestOrderAPIViews:
+    def test_create_order(self, api_client, monobank, task_queue, books):
+        url = reverse("order-create")
+        data = {
+            "order": [
+                {"book_id": books[0].id, "quantity": 2},
+                {"book_id": books[1].id, "quantity": 1},
+                {"book_id": books[0].id, "quantity": 1},
+            ]
+        }
+        task_queue.run_pending()
+        response = api_client.post(url, data, format="json")
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.data["status"] == "pending_invoice"
+        monobank.create_invoice.assert_not_called()
+        assert sorted(Task.objects.values_list("name", flat=True)) == [
+            "api.mono.create_invoice",
+            "api.stats.apply_stats",
+        ]
+        task_queue.run_pending()
+        order = Order.objects.get(pk=response.data["id"])
+        assert order.total_price == 500
+        assert order.status == "created"
+        assert order.invoice_id == "inv-1"
+        assert order.page_url == "https://pay.mbnk.biz/inv-1"
+        assert dict(order.orderitem_set.values_list("book_id", "quantity")) == {
+            books[0].id: 3,
+            books[1].id: 1,
+        }
+        assert Book.objects.get(pk=books[0].pk).quantity == 2
+        assert Book.objects.get(pk=books[1].pk).quantity == 4
+        body = monobank.create_invoice.call_args.args[0]
+        assert body["amount"] == 500
+        assert body["merchantPaymInfo"]["reference"] == str(order.id)
+        assert len(body["merchantPaymInfo"]["basketOrder"]) == 2
+
+    def test_order_status(self, api_client, monobank, task_queue, books):
+        data = {"order": [{"book_id": books[0].id, "quantity": 1}]}
+        order_id = api_client.post(reverse("order-create"), data, format="json").data[
+            "id"
+        ]
+        url = reverse("order-status", kwargs={"pk": order_id})
+        response = api_client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["status"] == "pending_invoice"
+        assert response.data["url"] is None
+        task_queue.run_pending()
+        response = api_client.get(url, {"wait": 5})
+        assert response.data["status"] == "created"
+        assert response.data["url"] == "https://pay.mbnk.biz/inv-1"
+
+    def test_sync_status_does_not_long_poll(
+        self, api_client, settings, monobank, books
+    ):
+        settings.ORDER_STATUS_SYNC_MAX_WAIT = 0
+        data = {"order": [{"book_id": books[0].id, "quantity": 1}]}
+        order_id = api_client.post(reverse("order-create"), data, format="json").data[
+            "id"
+        ]
+        url = reverse("order-status", kwargs={"pk": order_id})
+        started = time.monotonic()
+        response = api_client.get(url, {"wait": 5})
+        assert time.monotonic() - started < 1
+        assert response.data["status"] == "pending_invoice"
+        assert response["Retry-After"] == "1"
+
+    def test_invoice_failure_restocks(self, api_client, monobank, task_queue, books):
+        monobank.create_invoice.side_effect = MonobankError("503")
+        data = {"order": [{"book_id": books[0].id, "quantity": 3}]}
+        response = api_client.post(reverse("order-create"), data, format="json")
+        assert Book.objects.get(pk=books[0].pk).quantity == 2
+        task_queue.run_pending()
+        assert Order.objects.get(pk=response.data["id"]).status == "invoice_failed"
+        assert Book.objects.get(pk=books[0].pk).quantity == 5
+
+    def test_create_order_not_enough_stock(self, api_client, monobank, books):
+        url = reverse("order-create")
+        data = {
+            "order": [
+                {"book_id": books[0].id, "quantity": 1},
+                {"book_id": books[1].id, "quantity": 6},
+            ]
+        }
+        response = api_client.post(url, data, format="json")
+        assert response.data["error"] == "Not enough books in stock"
+        assert Order.objects.count() == 0
+        assert OrderItem.objects.count() == 0
+        assert Book.objects.get(pk=books[0].pk).quantity == 5
+        monobank.create_invoice.assert_not_called()
+
+    def test_create_order_unknown_book(self, api_client, monobank, books):
+        url = reverse("order-create")
+        data = {"order": [{"book_id": 0, "quantity": 1}]}
+        response = api_client.post(url, data, format="json")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert Order.objects.count() == 0
+
+    def test_create_order_queries_constant_in_basket_size(
+        self, api_client, monobank, task_queue, books
+    ):
+        url = reverse("order-create")
+        counts = []
+        for basket in (books[:1], books):
+            data = {"order": [{"book_id": b.id, "quantity": 1} for b in basket]}
+            with CaptureQueriesContext(connection) as queries:
+                response = api_client.post(url, data, format="json")
+            assert response.status_code == status.HTTP_202_ACCEPTED
+            counts.append(len(queries))
+        assert counts[0] == counts[1]
+
+
+def mono_response(status_code, data=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(data or {}).encode()
+    return response
+
+
+class TestMonobankClient:
+    @pytest.fixture
+    def client(self):
+        client = MonobankClient(
+            "https://api.monobank.ua", "token", backoff=0, breaker=CircuitBreaker(3)
+        )
+        with mock.patch.object(client.session, "request") as request:
+            client.request_mock = request
+            yield client
+
+    def test_get_pubkey_retries_server_errors(self, client):
+        client.request_mock.side_effect = [
+            mono_response(502),
+            requests.ConnectionError(),
+            mono_response(200, {"key": "pubkey"}),
+        ]
+        assert client.get_pubkey() == "pubkey"
+        assert client.request_mock.call_count == 3
+        assert client.request_mock.call_args.kwargs["timeout"] == client.timeout
+
+    def test_create_invoice_is_not_retried(self, client):
+        client.request_mock.side_effect = [mono_response(502)]
+        with pytest.raises(MonobankError):
+            client.create_invoice({"amount": 100})
+        assert client.request_mock.call_count == 1
+
+    def test_client_errors_are_not_retried(self, client):
+        client.request_mock.side_effect = [mono_response(403)]
+        with pytest.raises(MonobankError):
+            client.get_pubkey()
+        assert client.request_mock.call_count == 1
+
+    def test_circuit_opens_after_failures(self, client):
+        client.request_mock.return_value = mono_response(503)
+        with pytest.raises(MonobankError):
+            client.get_pubkey()
+        with pytest.raises(CircuitOpenError):
+            client.get_pubkey()
+        assert client.request_mock.call_count == 3
+
+
+def make_mono_key():
+    signing_key = ecdsa.SigningKey.generate(curve=ecdsa.NIST256p)
+    public_key = base64.b64encode(signing_key.get_verifying_key().to_pem()).decode()
+    return signing_key, public_key
+
+
+def mono_sign(signing_key, body):
+    signature = signing_key.sign(
+        body, hashfunc=hashlib.sha256, sigencode=ecdsa.util.sigencode_der
+    )
+    return base64.b64encode(signature).decode()
+
+
+@pytest.fixture
+def mono_key():
+    signing_key, public_key = make_mono_key()
+    MonoSettings.objects.create(public_key=public_key)
+    key_cache.clear()
+    yield signing_key
+    key_cache.clear()
+
+
+@pytest.mark.django_db
+class TestMonoCallbackSignature:
+    body = b'{"invoiceId": "inv-1", "status": "success"}'
+
+    def test_verify_callback_caches_key(self, mono_key, django_assert_num_queries):
+        assert verify_callback(mono_sign(mono_key, self.body), self.body)
+        with django_assert_num_queries(0):
+            assert verify_callback(mono_sign(mono_key, self.body), self.body)
+
+    def test_verify_callback_refreshes_rotated_key(self, mono_key, monobank):
+        signing_key, public_key = make_mono_key()
+        monobank.get_pubkey.return_value = public_key
+        assert verify_callback(mono_sign(mono_key, self.body), self.body)
+        assert verify_callback(mono_sign(signing_key, self.body), self.body)
+        assert MonoSettings.objects.last().public_key == public_key
+        assert not verify_callback(mono_sign(mono_key, self.body), self.body)
+        monobank.get_pubkey.assert_called_once()
+
+    @pytest.mark.parametrize(
+        "backend",
+        ["api.signatures.CryptographyVerifier", "api.signatures.EcdsaVerifier"],
+    )
+    def test_signature_backends(self, settings, mono_key, backend):
+        settings.MONOBANK_SIGNATURE_BACKEND = backend
+        public_key = MonoSettings.objects.last().public_key
+        signature = mono_sign(mono_key, self.body)
+        assert verify_signature(public_key, signature, self.body)
+        assert not verify_signature(public_key, signature, self.body + b" ")
+        assert not verify_signature(public_key, "not base64", self.body)
+
+    def test_callback_signature_mismatch(self, api_client, mono_key, monobank):
+        monobank.get_pubkey.return_value = MonoSettings.objects.last().public_key
+        response = api_client.post(
+            reverse("mono_callback"),
+            self.body,
+            content_type="application/json",
+            HTTP_X_SIGN=mono_sign(make_mono_key()[0], self.body),
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data["status"] == "signature mismatch"
+
+
+@pytest.mark.django_db
+class TestOrderList:
+    @pytest.mark.parametrize("orders", [1, 8])
+    def test_queries_per_page_are_constant(
+        self, api_client, books, orders, django_assert_num_queries
+    ):
+        for i in range(orders):
+            order = Order.objects.create(total_price=0, status="created")
+            for book in books:
+                OrderItem.objects.create(
+                    order=order, book=book, quantity=i + 1, price=book.price
+                )
+        with django_assert_num_queries(3):
+            response = api_client.get(reverse("order-list"))
+        order = response.data["results"][0]
+        assert order["books"] == [book.id for book in books]
+        assert order["items"][0] == {
+            "book_id": books[0].id,
+            "title": "Book 1",
+            "price": 100,
+            "quantity": orders,
+        }
+
+    @pytest.mark.parametrize("ordering", ["created_at", "-created_at"])
+    def test_cursor_over_created_at(self, api_client, ordering):
+        orders = [Order.objects.create(total_price=0) for _ in range(6)]
+        for i, order in enumerate(orders):
+            # Microseconds apart, well within one millisecond.
+            Order.objects.filter(pk=order.pk).update(
+                created_at=f"2024-01-01T12:00:00.00010{i}Z"
+            )
+        expected = [order.id for order in orders]
+        if ordering.startswith("-"):
+            expected.reverse()
+        url, ids = reverse("order-list"), []
+        params = {"cursor": "", "ordering": ordering, "limit": 2}
+        while url and len(ids) <= len(orders):
+            response = api_client.get(url, params)
+            ids += [order["id"] for order in response.data["results"]]
+            url, params = response.data["next"], None
+        assert ids == expected
+
+    def test_item_price_falls_back_to_book_price(self, api_client, books):
+        order = Order.objects.create(total_price=0)
+        OrderItem.objects.create(order=order, book=books[1], quantity=1)
+        response = api_client.get(reverse("order-list"))
+        assert response.data["results"][0]["items"][0]["price"] == 200
+
+
+@pytest.mark.django_db
+class TestOrderFilters:
+    @pytest.fixture
+    def orders(self):
+        orders = [
+            Order.objects.create(total_price=100 * i, invoice_id=f"inv-{i}", status=s)
+            for i, s in enumerate(["created", "success", "failure", "success"])
+        ]
+        for day, order in enumerate(orders, start=1):
+            Order.objects.filter(pk=order.pk).update(
+                created_at=f"2024-01-0{day}T12:00:00Z"
+            )
+        return orders
+
+    def ids(self, api_client, params):
+        response = api_client.get(reverse("order-list"), params)
+        assert response.status_code == status.HTTP_200_OK
+        return [order["id"] for order in response.data["results"]]
+
+    @pytest.mark.parametrize(
+        "params, expected",
+        [
+            ({"status": "success"}, [3, 1]),
+            ({"status": "created,failure"}, [2, 0]),
+            ({"status": "succ"}, []),
+            ({"invoice_id": "inv-2"}, [2]),
+            ({"invoice_id": "inv"}, []),
+            ({"created_after": "2024-01-02", "created_before": "2024-01-04"}, [2, 1]),
+            ({"total_price_min": 100, "total_price_max": 200}, [2, 1]),
+            ({"status": "success", "created_after": "2024-01-03"}, [3]),
+        ],
+    )
+    def test_filters(self, api_client, orders, params, expected):
+        assert self.ids(api_client, params) == [orders[i].id for i in expected]
+
+    def test_browsable_api(self, api_client, settings, orders):
+        # The manifest storage needs collectstatic, which tests do not run.
+        settings.STORAGES = {
+            "staticfiles": {
+                "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+            }
+        }
+        response = api_client.get(
+            reverse("order-list"), {"status": "success"}, HTTP_ACCEPT="text/html"
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert b'name="status"' in response.content
+
+    def test_invalid_filter(self, api_client, orders):
+        response = api_client.get(reverse("order-list"), {"total_price_min": "a"})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_export_filters(self, authenticated_client, orders):
+        response = authenticated_client.get(
+            reverse("order-export"), {"status": "success", "ordering": "id"}
+        )
+        lines = b"".join(response.streaming_content).splitlines()
+        assert [json.loads(line)["id"] for line in lines] == [
+            orders[1].id,
+            orders[3].id,
+        ]
+
+    def test_invoice_id_is_unique(self, orders):
+        with pytest.raises(IntegrityError), transaction.atomic():
+            Order.objects.create(total_price=0, invoice_id="inv-1")
+        Order.objects.create(total_price=0)
+        Order.objects.create(total_price=0)
+
+
+@pytest.mark.django_db
+class TestExports:
+    def content(self, response):
+        assert response.streaming
+        return b"".join(response.streaming_content).decode()
+
+    def test_books_ndjson(self, api_client, books):
+        response = api_client.get(reverse("book-export"), {"ordering": "-price"})
+        assert response["Content-Type"] == "application/x-ndjson"
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        assert [row["id"] for row in rows] == [book.id for book in books[::-1]]
+        assert rows[0]["author__name"] == "John Doe"
+        assert rows[0]["publication_date"] == "2022-01-01"
+
+    def test_books_csv(self, api_client, books):
+        response = api_client.get(
+            reverse("book-export"), {"format": "csv", "search": "Book 2"}
+        )
+        assert response["Content-Type"] == "text/csv"
+        lines = self.content(response).splitlines()
+        assert lines[0].startswith("id,isbn,title")
+        assert lines[1].split(",")[2] == "Book 2"
+        assert len(lines) == 2
+
+    def test_orders_created_at_range(self, authenticated_client):
+        orders = [Order.objects.create(total_price=i) for i in range(3)]
+        for day, order in enumerate(orders, start=1):
+            Order.objects.filter(pk=order.pk).update(
+                created_at=f"2024-01-0{day}T12:00:00Z"
+            )
+        response = authenticated_client.get(
+            reverse("order-export"),
+            {"created_after": "2024-01-02", "created_before": "2024-01-03"},
+        )
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        assert [row["id"] for row in rows] == [orders[1].id]
+        assert rows[0]["created_at"].startswith("2024-01-02T12:00:00")
+
+    def test_orders_invalid_range(self, authenticated_client):
+        response = authenticated_client.get(
+            reverse("order-export"), {"created_after": "yesterday"}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_orders_require_authentication(self, api_client):
+        response = api_client.get(reverse("order-export"))
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def book_quantities(books):
+    return list(
+        Book.objects.filter(id__in=[b.id for b in books[:2]])
+        .order_by("id")
+        .values_list("quantity", flat=True)
+    )
+
+
+def send_callback(api_client, signing_key, order, callback_status, modified):
+    body = json.dumps(
+        {
+            "invoiceId": order.invoice_id,
+            "status": callback_status,
+            "amount": order.total_price,
+            "ccy": 980,
+            "reference": str(order.id),
+            "modifiedDate": modified,
+        }
+    ).encode()
+    return api_client.post(
+        reverse("mono_callback"),
+        body,
+        content_type="application/json",
+        HTTP_X_SIGN=mono_sign(signing_key, body),
+    )
+
+
+@pytest.mark.django_db
+class TestMonoCallbackInbox:
+    @pytest.fixture
+    def order(self, books):
+        order = Order.objects.create(
+            total_price=300, invoice_id="inv-1", status="created"
+        )
+        OrderItem.objects.create(order=order, book=books[0], quantity=2, price=100)
+        OrderItem.objects.create(order=order, book=books[1], quantity=1, price=200)
+        return order
+
+    def test_callbacks_are_deduplicated(self, api_client, mono_key, order):
+        for _ in range(2):
+            response = send_callback(
+                api_client, mono_key, order, "failure", "2024-01-01T10:00:00Z"
+            )
+            assert response.status_code == status.HTTP_200_OK
+            assert response.data["status"] == "accepted"
+        assert MonoCallback.objects.count() == 1
+
+    def test_failure_restocks_every_item_once(self, api_client, mono_key, order, books):
+        for _ in range(2):
+            send_callback(
+                api_client, mono_key, order, "failure", "2024-01-01T10:00:00Z"
+            )
+        send_callback(api_client, mono_key, order, "processing", "2024-01-01T09:00:00Z")
+        process_callbacks()
+        order.refresh_from_db()
+        assert order.status == "failure"
+        assert book_quantities(books) == [7, 6]
+        assert not MonoCallback.objects.filter(processed=False).exists()
+
+    def test_leaving_restock_status_takes_stock_again(
+        self, api_client, mono_key, order, books
+    ):
+        send_callback(api_client, mono_key, order, "hold", "2024-01-01T10:00:00Z")
+        process_callbacks()
+        assert book_quantities(books) == [7, 6]
+        send_callback(api_client, mono_key, order, "success", "2024-01-01T10:05:00Z")
+        process_callbacks()
+        assert Order.objects.get(pk=order.pk).status == "success"
+        assert book_quantities(books) == [5, 5]
+
+    def test_invoice_mismatch_is_ignored(self, api_client, mono_key, order, books):
+        order.invoice_id = "inv-2"
+        send_callback(api_client, mono_key, order, "failure", "2024-01-01T10:00:00Z")
+        process_callbacks()
+        assert Order.objects.get(pk=order.pk).status == "created"
+        assert book_quantities(books) == [5, 5]
+
+    def test_reference_mismatch_is_ignored(self, api_client, mono_key, order, books):
+        other = Order.objects.create(total_price=0, invoice_id="inv-2")
+        order.id = other.id
+        send_callback(api_client, mono_key, order, "failure", "2024-01-01T10:00:00Z")
+        process_callbacks()
+        assert set(Order.objects.values_list("status", flat=True)) == {None, "created"}
+        assert book_quantities(books) == [5, 5]
+
+
+@pytest.mark.django_db
+class TestStockHolds:
+    @pytest.fixture
+    def order(self, api_client, monobank, task_queue, books):
+        data = {
+            "order": [
+                {"book_id": books[0].id, "quantity": 2},
+                {"book_id": books[1].id, "quantity": 1},
+            ]
+        }
+        response = api_client.post(reverse("order-create"), data, format="json")
+        task_queue.run_pending()
+        return Order.objects.get(pk=response.data["id"])
+
+    def expire(self, order):
+        StockHold.objects.filter(order=order).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+    def test_checkout_creates_holds(self, order, books, monobank):
+        holds = StockHold.objects.filter(order=order).order_by("book_id")
+        assert [(h.book_id, h.quantity) for h in holds] == [
+            (books[0].id, 2),
+            (books[1].id, 1),
+        ]
+        assert holds[0].expires_at > timezone.now()
+        assert book_quantities(books) == [3, 4]
+        assert monobank.create_invoice.call_args.args[0]["validity"] > 60
+
+    def test_active_holds_are_kept(self, order, books):
+        assert release_expired_holds() == 0
+        assert book_quantities(books) == [3, 4]
+
+    def test_expired_holds_are_released(self, order, books):
+        self.expire(order)
+        assert release_expired_holds() == 1
+        assert not StockHold.objects.exists()
+        assert Order.objects.get(pk=order.pk).status == "expired"
+        assert book_quantities(books) == [5, 5]
+
+    def test_expired_callback_after_release(self, api_client, mono_key, order, books):
+        self.expire(order)
+        call_command("release_holds", stdout=io.StringIO())
+        send_callback(api_client, mono_key, order, "expired", "2024-01-01T10:00:00Z")
+        process_callbacks()
+        assert book_quantities(books) == [5, 5]
+
+    def test_paid_before_lock_is_not_expired(self, order, books):
+        self.expire(order)
+        select_for_update = Order.objects.select_for_update
+
+        def paid_meanwhile(**kwargs):
+            StockHold.objects.filter(order=order).delete()
+            Order.objects.filter(pk=order.pk).update(status="success")
+            return select_for_update(**kwargs)
+
+        with mock.patch.object(Order.objects, "select_for_update", paid_meanwhile):
+            assert release_expired_holds() == 0
+        assert Order.objects.get(pk=order.pk).status == "success"
+        assert book_quantities(books) == [3, 4]
+
+    def test_locked_batch_is_skipped(self, api_client, order, books):
+        second = {"order": [{"book_id": books[2].id, "quantity": 1}]}
+        api_client.post(reverse("order-create"), second, format="json")
+        StockHold.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        select_for_update = Order.objects.select_for_update
+
+        def first_locked(**kwargs):
+            return select_for_update(**kwargs).exclude(pk=order.pk)
+
+        with mock.patch.object(Order.objects, "select_for_update", first_locked):
+            assert release_expired_holds(batch_size=1) == 1
+        assert Order.objects.get(pk=order.pk).status != "expired"
+        assert StockHold.objects.filter(order=order).exists()
+
+    def test_success_converts_holds(self, api_client, mono_key, order, books):
+        send_callback(api_client, mono_key, order, "success", "2024-01-01T10:00:00Z")
+        process_callbacks()
+        assert not StockHold.objects.exists()
+        self.expire(order)
+        assert release_expired_holds() == 0
+        assert book_quantities(books) == [3, 4]
+
+
+@pytest.mark.django_db
+class TestStockShards:
+    def order(self, api_client, book, quantity):
+        data = {"order": [{"book_id": book.id, "quantity": quantity}]}
+        return api_client.post(reverse("order-create"), data, format="json")
+
+    def shard_quantities(self, book):
+        return list(
+            StockShard.objects.filter(book=book)
+            .order_by("index")
+            .values_list("quantity", flat=True)
+        )
+
+    def test_set_stock_spreads_evenly(self, books):
+        set_stock(books[0], 11, 4)
+        assert self.shard_quantities(books[0]) == [3, 3, 3, 2]
+        set_stock(books[0], 7, 0)
+        assert not StockShard.objects.exists()
+        assert Book.objects.get(pk=books[0].pk).quantity == 7
+
+    def test_order_takes_from_shards(self, api_client, monobank, task_queue, books):
+        call_command("shard_stock", books[0].id, shards=3, stdout=io.StringIO())
+        response = self.order(api_client, books[0], 2)
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert sum(self.shard_quantities(books[0])) == 3
+        book = Book.objects.get(pk=books[0].pk)
+        assert get_available([book]) == {book.id: 3}
+
+    def test_order_spans_shards(self, api_client, monobank, task_queue, books):
+        set_stock(books[0], 5, 3)
+        assert self.order(api_client, books[0], 4).status_code == 202
+        assert sum(self.shard_quantities(books[0])) == 1
+        assert self.order(api_client, books[0], 2).data["error"]
+        assert sum(self.shard_quantities(books[0])) == 1
+        assert Order.objects.count() == 1
+
+    def test_negative_shard_blocks_single_shard_path(
+        self, api_client, monobank, task_queue, books
+    ):
+        set_stock(books[0], 2, 2)
+        StockShard.objects.filter(book=books[0], index=0).update(quantity=5)
+        StockShard.objects.filter(book=books[0], index=1).update(quantity=-3)
+        assert self.order(api_client, books[0], 4).data["error"]
+        assert self.order(api_client, books[0], 2).status_code == 202
+        assert self.shard_quantities(books[0]) == [0, 0]
+
+    def test_taking_stock_back_keeps_shards_non_negative(self, books):
+        set_stock(books[0], 4, 2)
+        add_stock({books[0].id: -3})
+        assert self.shard_quantities(books[0]) == [1, 0]
+        add_stock({books[0].id: -3})
+        assert self.shard_quantities(books[0]) == [-2, 0]
+
+    def test_failed_invoice_restocks_shards(
+        self, api_client, monobank, task_queue, books
+    ):
+        set_stock(books[0], 5, 2)
+        monobank.create_invoice.side_effect = MonobankError("503")
+        self.order(api_client, books[0], 3)
+        task_queue.run_pending()
+        assert sum(self.shard_quantities(books[0])) == 5
+
+    @pytest.mark.parametrize("sharded", [1, 4])
+    def test_list_reads_shard_totals_once(
+        self, api_client, books, sharded, django_assert_num_queries
+    ):
+        for book in books[:sharded]:
+            set_stock(book, 7, 2)
+        with django_assert_num_queries(3):
+            response = api_client.get(reverse("book-list"))
+        quantities = [book["quantity"] for book in response.data["results"]]
+        assert quantities == [7] * sharded + [5] * (5 - sharded)
+
+    def test_book_shows_shard_total(self, api_client, monobank, task_queue, books):
+        set_stock(books[0], 5, 2)
+        self.order(api_client, books[0], 2)
+        response = api_client.get(reverse("book-detail", kwargs={"pk": books[0].pk}))
+        assert response.data["quantity"] == 3
+        assert response.data["stock_shards"] == 2
+        sync_sharded_stock()
+        assert Book.objects.get(pk=books[0].pk).quantity == 3
+
+
+@pytest.fixture(params=["api.stockgate.LocalStockGate", "api.stockgate.RedisStockGate"])
+def stock_gate(request, settings):
+    settings.STOCK_GATE = request.param
+    if request.param.endswith("RedisStockGate"):
+        _gates[request.param] = RedisStockGate(fakeredis.FakeRedis())
+    else:
+        _gates.pop(request.param, None)
+    yield get_stock_gate()
+    _gates.pop(request.param, None)
+
+
+@pytest.mark.django_db
+class TestStockGate:
+    def order(self, api_client, book, quantity):
+        data = {"order": [{"book_id": book.id, "quantity": quantity}]}
+        return api_client.post(reverse("order-create"), data, format="json")
+
+    def test_reconcile_seeds_and_corrects(self, stock_gate, books):
+        assert stock_gate.reconcile() == 5
+        assert stock_gate.get_levels([books[0].id]) == {books[0].id: 5}
+        stock_gate.add({books[0].id: -2})
+        assert stock_gate.reconcile() == 1
+        assert stock_gate.get_levels([books[0].id]) == {books[0].id: 5}
+
+    def test_reconcile_keeps_concurrent_restock(self, stock_gate, books):
+        stock_gate.reconcile()
+        stock_levels = stockgate.stock_levels
+
+        def restocked_meanwhile(book_ids):
+            levels = stock_levels(book_ids)
+            Book.objects.filter(pk=books[0].pk).update(quantity=10)
+            stock_gate.add({books[0].id: 5})
+            return levels
+
+        with mock.patch.object(stockgate, "stock_levels", restocked_meanwhile):
+            assert stock_gate.reconcile() == 0
+        assert stock_gate.get_levels([books[0].id]) == {books[0].id: 10}
+
+    def test_gate_rejects_before_database(self, api_client, stock_gate, books):
+        stock_gate.reconcile()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.order(api_client, books[0], 6)
+        assert response.data["error"] == "Not enough books in stock"
+        assert not any(q["sql"].startswith("UPDATE") for q in queries)
+
+    def test_order_and_restock_update_gate(
+        self,
+        api_client,
+        monobank,
+        task_queue,
+        stock_gate,
+        books,
+        django_capture_on_commit_callbacks,
+    ):
+        stock_gate.reconcile()
+        monobank.create_invoice.side_effect = MonobankError("503")
+        assert self.order(api_client, books[0], 2).status_code == 202
+        assert stock_gate.get_levels([books[0].id]) == {books[0].id: 3}
+        with django_capture_on_commit_callbacks(execute=True):
+            task_queue.run_pending()
+        assert stock_gate.get_levels([books[0].id]) == {books[0].id: 5}
+
+    def test_database_rejection_releases_gate(self, api_client, stock_gate, books):
+        stock_gate.set_levels({books[0].id: 10})
+        assert self.order(api_client, books[0], 6).data["error"]
+        assert stock_gate.get_levels([books[0].id]) == {books[0].id: 10}
+
+    def test_unknown_books_go_to_database(
+        self, api_client, monobank, task_queue, stock_gate, books
+    ):
+        assert self.order(api_client, books[0], 2).status_code == 202
+        assert book_quantities(books)[0] == 3
+
+
+class TestAsyncMonobankClient:
+    def client(self, *responses):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            response = responses[len(calls) - 1]
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        client = AsyncMonobankClient(
+            "https://api.monobank.ua",
+            "token",
+            backoff=0,
+            transport=httpx.MockTransport(handler),
+        )
+        return client, calls
+
+    def test_get_pubkey_retries_server_errors(self):
+        client, calls = self.client(
+            httpx.Response(502),
+            httpx.ConnectError("refused"),
+            httpx.Response(200, json={"key": "pubkey"}),
+        )
+        assert async_to_sync(client.get_pubkey)() == "pubkey"
+        assert len(calls) == 3
+        assert calls[0].headers["X-Token"] == "token"
+
+    def test_create_invoice_is_not_retried(self):
+        client, calls = self.client(httpx.Response(502))
+        with pytest.raises(MonobankError):
+            async_to_sync(client.create_invoice)({"amount": 100})
+        assert len(calls) == 1
+
+
+@pytest.mark.django_db
+class TestAsyncViews:
+    factory = AsyncRequestFactory()
+
+    def call(self, view, request, **kwargs):
+        return async_to_sync(view.as_view())(request, **kwargs)
+
+    def post_order(self, data):
+        request = self.factory.post(
+            "/api/order/", json.dumps(data), content_type="application/json"
+        )
+        return self.call(views.AsyncOrderView, request)
+
+    def test_order_is_accepted(self, monobank, task_queue, books):
+        response = self.post_order({"order": [{"book_id": books[0].id, "quantity": 2}]})
+        assert response.status_code == 202
+        order = Order.objects.get(pk=json.loads(response.content)["id"])
+        assert order.status == "pending_invoice"
+        assert book_quantities(books) == [3, 5]
+
+    def test_invalid_order(self, books):
+        response = self.post_order({"order": [{"book_id": books[0].id}]})
+        assert response.status_code == 400
+        assert "order" in json.loads(response.content)
+
+    def test_order_status(self, books):
+        order = Order.objects.create(total_price=100, status="created")
+        request = self.factory.get(f"/api/order/{order.pk}/")
+        response = self.call(views.AsyncOrderStatusView, request, pk=order.pk)
+        assert json.loads(response.content)["status"] == "created"
+        assert "Retry-After" not in response
+        response = self.call(views.AsyncOrderStatusView, request, pk=order.pk + 1)
+        assert response.status_code == 404
+
+    def test_pending_order_status_asks_to_retry(self, books):
+        order = Order.objects.create(total_price=100, status="pending_invoice")
+        request = self.factory.get(f"/api/order/{order.pk}/")
+        response = self.call(views.AsyncOrderStatusView, request, pk=order.pk)
+        assert json.loads(response.content)["status"] == "pending_invoice"
+        assert response["Retry-After"] == "1"
+
+    def test_acreate_invoice(self, monobank, task_queue, books):
+        response = self.post_order({"order": [{"book_id": books[0].id, "quantity": 1}]})
+        client = mock.Mock(spec=AsyncMonobankClient)
+        client.create_invoice = mock.AsyncMock(
+            return_value={"invoiceId": "inv-2", "pageUrl": "https://pay/inv-2"}
+        )
+        previous = set_async_client(client)
+        try:
+            async_to_sync(acreate_invoice)(json.loads(response.content)["id"], "url")
+        finally:
+            set_async_client(previous)
+        order = Order.objects.get()
+        assert (order.status, order.invoice_id) == ("created", "inv-2")
+        assert client.create_invoice.call_args.args[0]["amount"] == 100
+
+    def test_callback_is_stored(self, mono_key, task_queue):
+        body = json.dumps(
+            {
+                "invoiceId": "inv-1",
+                "status": "success",
+                "amount": 100,
+                "ccy": 980,
+                "reference": "1",
+            }
+        ).encode()
+        request = self.factory.post(
+            "/api/monobank/callback",
+            body,
+            content_type="application/json",
+            headers={"X-Sign": mono_sign(mono_key, body)},
+        )
+        response = self.call(views.AsyncOrderCallbackView, request)
+        assert json.loads(response.content) == {"status": "accepted"}
+        assert MonoCallback.objects.get().invoice_id == "inv-1"
+
+    def test_book_list_matches_sync_view(self, api_client, books):
+        set_stock(books[0], 7, 2)
+        url = reverse("book-list") + "?ordering=-price&limit=2&offset=1"
+        expected = api_client.get(url)
+        cache.clear()
+        response = self.call(views.AsyncBookList, self.factory.get(url))
+        assert json.loads(response.content) == json.loads(expected.content)
+        request = self.factory.get(url, headers={"If-None-Match": response["ETag"]})
+        assert self.call(views.AsyncBookList, request).status_code == 304
+
+    def test_expanded_author_list_falls_back(self, api_client, books):
+        url = reverse("author-list") + "?expand=books"
+        response = self.call(views.AsyncAuthorList, self.factory.get(url))
+        response.render()
+        assert response.data["results"][0]["books_count"] == 5
+
+
+@pytest.mark.django_db
+class TestMetrics:
+    def server_timing(self, response):
+        return dict(
+            entry.split(";", 1) for entry in response["Server-Timing"].split(", ")
+        )
+
+    def test_server_timing(self, api_client, books):
+        with CaptureQueriesContext(connection) as queries:
+            response = api_client.get(reverse("book-list"))
+        timing = self.server_timing(response)
+        assert timing["db"].endswith(f'desc="{len(queries)} queries"')
+        assert "serializer" in timing
+        assert "total" in timing
+
+    def test_cached_response_has_no_queries(self, api_client, books):
+        api_client.get(reverse("book-list"))
+        response = api_client.get(reverse("book-list"))
+        assert self.server_timing(response)["db"].endswith('desc="0 queries"')
+        assert "serializer" not in self.server_timing(response)
+
+    def test_metrics_endpoint(self, api_client, settings, books):
+        settings.DEBUG = True
+        api_client.get(reverse("book-list"))
+        response = api_client.get(reverse("metrics"))
+        assert response["Content-Type"].startswith("text/plain")
+        body = response.content.decode()
+        assert "# TYPE http_request_db_queries histogram" in body
+        assert 'http_request_db_queries_count{method="GET",view="book-list"}' in body
+        assert 'le="+Inf"' in body
+
+    def test_metrics_token(self, api_client, settings):
+        settings.METRICS_TOKEN = "secret"
+        assert api_client.get(reverse("metrics")).status_code == 403
+        response = api_client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret"
+        )
+        assert response.status_code == 200
+
+    def test_metrics_need_token_outside_debug(self, api_client, settings):
+        settings.DEBUG = False
+        assert api_client.get(reverse("metrics")).status_code == 404
+
+    def test_monobank_calls_are_timed(self):
+        client = MonobankClient("https://api.monobank.ua", "token")
+        token = request_timings.set({})
+        try:
+            with mock.patch.object(client.session, "request") as request:
+                request.return_value = mono_response(200, {"key": "pubkey"})
+                client.get_pubkey()
+            assert request_timings.get()["monobank"][0] == 1
+        finally:
+            request_timings.reset(token)
+        assert (("endpoint", "/api/merchant/pubkey"),) in MONOBANK_SECONDS.series
+
+
+@pytest.mark.django_db
+class TestQueryCheck:
+    def test_repeated_queries(self, books):
+        with pytest.raises(
+            QueryCheckError, match="5 similar queries from api/tests.py"
+        ):
+            with check_queries():
+                for book in books:
+                    Book.objects.get(id=book.id)
+
+    def test_allowed_repeats(self, books):
+        with check_queries() as check:
+            with allow_repeats():
+                for book in books:
+                    Book.objects.get(id=book.id)
+        assert len(check.queries) == 5
+
+    def test_in_lists_are_similar(self, books):
+        with pytest.raises(QueryCheckError, match="3 similar queries"):
+            with check_queries():
+                for n in range(1, 4):
+                    list(Book.objects.filter(id__in=[b.id for b in books[:n]]))
+
+    def test_budget(self, books):
+        with pytest.raises(QueryCheckError, match="2 queries over a budget of 1"):
+            with check_queries(budget=1):
+                Book.objects.count()
+                Author.objects.count()
+
+    def test_slow_query(self, settings, books):
+        settings.QUERYCHECK_SLOW_MS = 0
+        with pytest.raises(QueryCheckError, match="slow query .* from api/tests.py"):
+            with check_queries():
+                Book.objects.count()
+
+    def test_endpoint_budget(self, api_client, settings, books):
+        settings.QUERY_BUDGETS = {"book-list": 1}
+        with pytest.raises(QueryCheckError, match="GET book-list: 2 queries"):
+            api_client.get(reverse("book-list"))
+
+    def test_logs_without_raising(self, api_client, settings, books, caplog):
+        settings.QUERYCHECK_RAISE = False
+        settings.QUERY_BUDGETS = {"book-list": 1}
+        response = api_client.get(reverse("book-list"))
+        assert response.status_code == status.HTTP_200_OK
+        assert "GET book-list: 2 queries over a budget of 1" in caplog.text
+
+    def test_auth_endpoints(self, api_client):
+        credentials = {"username": "reader", "password": "secret-password"}
+        response = api_client.post(reverse("user-register"), credentials)
+        assert response.status_code == status.HTTP_201_CREATED
+        response = api_client.post(reverse("token_obtain_pair"), credentials)
+        assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+class TestTokenUserAuthentication:
+    def update_author(self, client, author):
+        url = reverse("author-update", kwargs={"pk": author.pk})
+        return client.put(url, {"name": "Jane Doe"}, format="json")
+
+    def test_no_user_query(self, authenticated_client, author):
+        self.update_author(authenticated_client, author)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.update_author(authenticated_client, author)
+        assert response.status_code == status.HTTP_200_OK
+        assert not any("auth_user" in query["sql"] for query in queries)
+
+    def test_inactive_user(self, authenticated_client, user, author):
+        assert self.update_author(authenticated_client, author).status_code == 200
+        user.is_active = False
+        user.save()
+        response = self.update_author(authenticated_client, author)
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_deleted_user(self, authenticated_client, user, author):
+        user.delete()
+        response = self.update_author(authenticated_client, author)
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_state_check_disabled(self, authenticated_client, settings, author):
+        settings.TOKEN_USER_STATE_TTL = None
+        with CaptureQueriesContext(connection) as queries:
+            response = self.update_author(authenticated_client, author)
+        assert response.status_code == status.HTTP_200_OK
+        assert not any("auth_user" in query["sql"] for query in queries)
+
+
+@pytest.mark.django_db
+class TestAuthEndpoints:
+    credentials = {"username": "reader", "password": "secret-password"}
+
+    def login(self, api_client, **data):
+        return api_client.post(
+            reverse("token_obtain_pair"), {**self.credentials, **data}
+        )
+
+    def test_hasher_profile(self, api_client):
+        api_client.post(reverse("user-register"), self.credentials)
+        assert User.objects.get(username="reader").password.startswith("scrypt$")
+
+    def test_old_hashes_are_upgraded(self, api_client):
+        User.objects.create(
+            username="reader",
+            password=make_password("secret-password", hasher="pbkdf2_sha256"),
+        )
+        assert self.login(api_client).status_code == status.HTTP_200_OK
+        assert User.objects.get(username="reader").password.startswith("scrypt$")
+
+    def test_hashing_pool_full(self, api_client, user):
+        busy = HashingPool(1, 0)
+        busy.slots.acquire()
+        with mock.patch("api.hashers.pool", busy):
+            response = self.login(api_client)
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+    def test_username_throttle(self, api_client):
+        for n in range(10):
+            response = self.login(api_client, password=f"guess-{n}")
+            assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        response = self.login(api_client, username="READER")
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert int(response["Retry-After"]) > 0
+        response = self.login(api_client, username="writer")
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_ip_throttle(self, api_client):
+        with mock.patch.dict(AuthIPThrottle.THROTTLE_RATES, {"auth_ip": "2/min"}):
+            statuses = [
+                self.login(api_client, username=f"user-{n}").status_code
+                for n in range(3)
+            ]
+        assert statuses[-1] == status.HTTP_429_TOO_MANY_REQUESTS
+
+    def test_bucket_refills(self, rf):
+        throttle = AuthIPThrottle()
+        now = 1000.0
+        throttle.timer = lambda: now
+        request = rf.post("/")
+        for _ in range(30):
+            assert throttle.allow_request(request, None)
+        assert not throttle.allow_request(request, None)
+        assert throttle.wait() == pytest.approx(2)
+        now += 2
+        assert throttle.allow_request(request, None)
+        assert not throttle.allow_request(request, None)
+
+
+@pytest.mark.django_db
+class TestCatalogueStats:
+    def stats(self, api_client, task_queue):
+        while task_queue.run_pending():
+            pass
+        return api_client.get(reverse("catalogue-stats")).data
+
+    def snapshot(self):
+        return (
+            set(AuthorStats.objects.values_list(*self.fields("author_id"))),
+            set(GenreStats.objects.values_list(*self.fields("genre"))),
+        )
+
+    def fields(self, key):
+        return key, "book_count", "stock_quantity", "stock_value"
+
+    def test_totals(self, api_client, task_queue, books):
+        data = self.stats(api_client, task_queue)
+        assert (data["book_count"], data["stock_quantity"]) == (5, 25)
+        assert data["stock_value"] == 7500
+        assert data["genres"] == [
+            {
+                "genre": "Fiction",
+                "book_count": 5,
+                "stock_quantity": 25,
+                "stock_value": 7500,
+            }
+        ]
+
+    def test_book_changes(self, api_client, authenticated_client, task_queue, books):
+        url = reverse("book-update", kwargs={"pk": books[0].pk})
+        data = {"genre": "Poetry", "price": 1000, "quantity": 2}
+        authenticated_client.patch(url, data, format="json")
+        authenticated_client.delete(reverse("book-delete", kwargs={"pk": books[1].pk}))
+        data = self.stats(api_client, task_queue)
+        assert [(g["genre"], g["stock_value"]) for g in data["genres"]] == [
+            ("Fiction", 6000),
+            ("Poetry", 2000),
+        ]
+        assert data["book_count"] == 4
+
+    def test_stock_movements(self, api_client, monobank, task_queue, books):
+        set_stock(books[0], 10, 2)
+        url = reverse("order-create")
+        for book in books[:2]:
+            order = {"order": [{"book_id": book.id, "quantity": 3}]}
+            api_client.post(url, order, format="json")
+        data = self.stats(api_client, task_queue)
+        assert data["stock_quantity"] == 25 + 5 - 6
+        assert data["stock_value"] == 7500 + 500 - 300 - 600
+        StockHold.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        release_expired_holds()
+        assert self.stats(api_client, task_queue)["stock_quantity"] == 30
+
+    def test_rebuild_matches(self, api_client, monobank, task_queue, books):
+        set_stock(books[2], 7, 3)
+        api_client.post(
+            reverse("order-create"),
+            {"order": [{"book_id": books[2].id, "quantity": 4}]},
+            format="json",
+        )
+        Book.objects.create(
+            title="Other",
+            author=Author.objects.create(name="Jane Roe"),
+            genre="Drama",
+            publication_date="2022-01-01",
+            price=50,
+            quantity=4,
+        )
+        self.stats(api_client, task_queue)
+        incremental = self.snapshot()
+        AuthorStats.objects.update(book_count=0)
+        call_command("rebuild_stats", stdout=io.StringIO())
+        assert self.snapshot() == incremental
+
+    def test_author_stats(self, api_client, task_queue, books):
+        other = Author.objects.create(name="Jane Roe")
+        Book.objects.create(
+            title="Other",
+            author=other,
+            genre="Drama",
+            publication_date="2022-01-01",
+            price=50,
+            quantity=4,
+        )
+        self.stats(api_client, task_queue)
+        response = api_client.get(reverse("author-stats"))
+        assert [row["name"] for row in response.data["results"]] == [
+            "John Doe",
+            "Jane Roe",
+        ]
+        response = api_client.get(reverse("author-stats"), {"ordering": "book_count"})
+        assert response.data["results"][0]["name"] == "Jane Roe"
+        other.delete()
+        self.stats(api_client, task_queue)
+        assert not AuthorStats.objects.filter(author_id=other.id).exists()
+        assert api_client.get(reverse("author-stats")).data["count"] == 1
+
+
+@pytest.mark.django_db
+class TestSalesAnalytics:
+    def order(self, days_ago, items, status="success"):
+        order = Order.objects.create(total_price=0, status=status)
+        for book, quantity in items:
+            OrderItem.objects.create(
+                order=order, book=book, quantity=quantity, price=book.price
+            )
+        created_at = timezone.now() - timedelta(days=days_ago)
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        return order
+
+    @pytest.fixture
+    def sales(self, books):
+        self.order(5, [(books[0], 2), (books[1], 1)])
+        self.order(5, [(books[0], 5)], status="pending")
+        self.order(4, [(books[2], 2)])
+        self.order(0, [(books[0], 1)])
+
+    def summary(self, client, days=5, **params):
+        end = timezone.localdate()
+        params = {"start": end - timedelta(days=days), "end": end, **params}
+        return client.get(reverse("sales-analytics"), params)
+
+    def test_summary(self, authenticated_client, books, sales):
+        data = self.summary(authenticated_client).data
+        assert (data["revenue"], data["orders"], data["units"]) == (1100, 3, 6)
+        assert [day["revenue"] for day in data["daily"]] == [400, 600, 0, 0, 0, 100]
+        assert [(b["id"], b["units"], b["revenue"]) for b in data["top_books"]] == [
+            (books[2].id, 2, 600),
+            (books[0].id, 3, 300),
+            (books[1].id, 1, 200),
+        ]
+        assert data["top_books"][0]["sell_through"] == round(2 / 7, 4)
+        assert data["basket_sizes"]["mean"] == 2.0
+        assert data["basket_sizes"]["p50"] == 2
+        assert data["basket_sizes"]["histogram"] == [
+            {"size": 1, "orders": 1},
+            {"size": 2, "orders": 1},
+            {"size": 3, "orders": 1},
+        ]
+
+    def test_settled_days_are_cached(self, authenticated_client, books, sales):
+        self.summary(authenticated_client)
+        self.order(5, [(books[4], 1)])
+        self.order(0, [(books[4], 1)])
+        data = self.summary(authenticated_client).data
+        assert data["daily"][0]["revenue"] == 400
+        assert data["daily"][-1]["revenue"] == 600
+
+    def test_chunks_and_windows(self, authenticated_client, books, settings):
+        settings.ANALYTICS_CHUNK_SIZE = 3
+        settings.ANALYTICS_WINDOW_DAYS = 2
+        settings.QUERY_BUDGETS = {**QUERY_BUDGETS, "sales-analytics": None}
+        for n in range(12):
+            self.order(n % 6, [(books[n % 5], 1 + n % 3), (books[(n + 1) % 5], 1)])
+        data = self.summary(authenticated_client).data
+        items = OrderItem.objects.filter(order__status="success")
+        assert data["units"] == sum(item.quantity for item in items)
+        assert data["revenue"] == sum(item.quantity * item.price for item in items)
+        assert sum(b["units"] for b in data["top_books"]) == data["units"]
+        assert sum(day["orders"] for day in data["daily"]) == 12
+
+    def test_order_paid_during_scan(self, authenticated_client, books, settings):
+        settings.ANALYTICS_CHUNK_SIZE = 1
+        settings.QUERY_BUDGETS = {**QUERY_BUDGETS, "sales-analytics": None}
+        late = self.order(4, [(books[1], 1)], status="pending")
+        self.order(5, [(books[0], 2)])
+        chunks = analytics.chunks
+
+        def paid_meanwhile(*args, **kwargs):
+            for n, rows in enumerate(chunks(*args, **kwargs)):
+                if n == 0:
+                    Order.objects.filter(pk=late.pk).update(status="success")
+                yield rows
+
+        with mock.patch.object(analytics, "chunks", paid_meanwhile):
+            data = self.summary(authenticated_client).data
+        assert [day["revenue"] for day in data["daily"]] == [200, 0, 0, 0, 0, 0]
+        assert data["orders"] == 1
+
+    def test_invalid_range(self, authenticated_client, api_client):
+        assert self.summary(authenticated_client, days=-1).status_code == 400
+        assert self.summary(authenticated_client, days=400).status_code == 400
+        assert self.summary(api_client).status_code == 401
+
+    def test_chart(self, authenticated_client, sales):
+        end = timezone.localdate()
+        url = reverse("sales-chart", kwargs={"chart": "baskets"})
+        response = authenticated_client.get(url, {"end": end})
+        assert response["Content-Type"] == "image/png"
+        assert response.content.startswith(b"\x89PNG")
+        url = reverse("sales-chart", kwargs={"chart": "pie"})
+        assert authenticated_client.get(url).status_code == 404
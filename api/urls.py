@@ -1,17 +1,30 @@
+from django.conf import settings
 from django.urls import path
 
 from api import views
-from api.views import OrderView, OrderCallbackView, OrdersViewSet
+from api.views import OrderView, OrderStatusView, OrderCallbackView, OrdersViewSet
+
+if settings.ASYNC_VIEWS:
+    OrderView = views.AsyncOrderView
+    OrderStatusView = views.AsyncOrderStatusView
+    OrderCallbackView = views.AsyncOrderCallbackView
+    BookList = views.AsyncBookList
+    AuthorList = views.AsyncAuthorList
+else:
+    BookList = views.BookList
+    AuthorList = views.AuthorList
 
 urlpatterns = [
     path("", views.home, name="home"),
-    path("books/", views.BookList.as_view(), name="book-list"),
+    path("books/", BookList.as_view(), name="book-list"),
     path("books/<int:pk>/", views.BookDetail.as_view(), name="book-detail"),
     path("books/create/", views.BookCreate.as_view(), name="book-create"),
+    path("books/import/", views.BookImport.as_view(), name="book-import"),
+    path("books/export/", views.BookExport.as_view(), name="book-export"),
     path("books/update/<int:pk>/", views.BookUpdate.as_view(), name="book-update"),
     path("books/delete/<int:pk>/", views.BookDelete.as_view(), name="book-delete"),
     path("authors/create/", views.AuthorCreate.as_view(), name="authors-create"),
-    path("authors/", views.AuthorList.as_view(), name="author-list"),
+    path("authors/", AuthorList.as_view(), name="author-list"),
     path("authors/<int:pk>/", views.AuthorDetail.as_view(), name="author-detail"),
     path(
         "authors/update/<int:pk>/", views.AuthorUpdate.as_view(), name="author-update"
@@ -19,13 +32,25 @@ urlpatterns = [
     path(
         "authors/delete/<int:pk>/", views.AuthorDelete.as_view(), name="author-delete"
     ),
+    path("stats/", views.CatalogueStatsView.as_view(), name="catalogue-stats"),
+    path("stats/authors/", views.AuthorStatsList.as_view(), name="author-stats"),
+    path(
+        "analytics/sales/", views.SalesAnalyticsView.as_view(), name="sales-analytics"
+    ),
+    path(
+        "analytics/sales/<str:chart>.png",
+        views.SalesChartView.as_view(),
+        name="sales-chart",
+    ),
     path("users/register/", views.UserRegistrationView.as_view(), name="user-register"),
     path(
         "users/token/",
         views.CustomTokenObtainPairView.as_view(),
         name="token_obtain_pair",
     ),
-    path("order/", OrderView.as_view()),
+    path("order/", OrderView.as_view(), name="order-create"),
+    path("order/<int:pk>/", OrderStatusView.as_view(), name="order-status"),
     path("monobank/callback", OrderCallbackView.as_view(), name="mono_callback"),
-    path("orders/", OrdersViewSet.as_view({"get": "list"})),
+    path("orders/", OrdersViewSet.as_view({"get": "list"}), name="order-list"),
+    path("orders/export/", views.OrderExport.as_view(), name="order-export"),
 ]
@@ -0,0 +1,52 @@
+"""
+Time the sales analytics over the seeded order history: a cold run that
+scans every day, then a warm run served from the per-day cache. Seed with
+`python -m benchmarks.seed --orders ... --days ...` first.
+
+    python -m benchmarks.bench_analytics --days 365
+"""
+import argparse
+import os
+import resource
+import time
+from datetime import timedelta
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "homework_20_api.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.cache import cache  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from api.analytics import sales_summary  # noqa: E402
+from api.models import OrderItem  # noqa: E402
+
+
+def run(label, start, end):
+    began = time.perf_counter()
+    summary = sales_summary(start, end)
+    elapsed = time.perf_counter() - began
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        f"{label}: {elapsed:.2f}s, peak RSS {peak / 1024:.0f} MiB, "
+        f"{summary['orders']} orders, {summary['units']} units"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+
+    end = timezone.localdate()
+    start = end - timedelta(days=args.days - 1)
+    print(f"{OrderItem.objects.count()} order items")
+    cache.clear()
+    run("cold", start, end)
+    run("warm", start, end)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Checkouts per second through WSGI (gunicorn sync workers, thread pool task
+queue) and ASGI (gunicorn uvicorn workers, async views and task queue)
+against a local fake Monobank with added latency. A checkout is
+POST /api/order/ followed by long polls of GET /api/order/<id>/ until the
+invoice is created. Run it against Postgres; SQLite locks out concurrent
+writers.
+
+    python -m benchmarks.bench_asgi --book-id 1 --latency 1 --concurrency 64
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.fake_monobank import serve
+
+MODES = {
+    "wsgi": (["homework_20_api.wsgi"], {}),
+    "asgi": (
+        ["homework_20_api.asgi", "-k", "uvicorn.workers.UvicornWorker"],
+        {"ASYNC_VIEWS": "1", "TASK_QUEUE": "api.tasks.AsyncioQueue"},
+    ),
+}
+
+
+def checkout(session, url, book_id):
+    r = session.post(
+        f"{url}/api/order/", json={"order": [{"book_id": book_id, "quantity": 1}]}
+    )
+    if r.status_code != 202:
+        return False
+    status_url = f"{url}/api/order/{r.json()['id']}/?wait=10"
+    while (status := session.get(status_url).json()["status"]) == "pending_invoice":
+        pass
+    return status == "created"
+
+
+def worker(url, book_id, deadline):
+    session = requests.Session()
+    done = failed = 0
+    while time.monotonic() < deadline:
+        if checkout(session, url, book_id):
+            done += 1
+        else:
+            failed += 1
+    return done, failed
+
+
+def start_server(mode, port, workers, monobank_url):
+    args, env = MODES[mode]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", *args]
+        + ["-w", str(workers), "-b", f"127.0.0.1:{port}"],
+        env={**os.environ, **env, "MONOBANK_API_URL": monobank_url},
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        try:
+            requests.get(f"{url}/api/books/?limit=1", timeout=5)
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def run(mode, args, monobank_url):
+    process, url = start_server(mode, args.port, args.workers, monobank_url)
+    try:
+        deadline = time.monotonic() + args.duration
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            results = list(
+                pool.map(
+                    lambda _: worker(url, args.book_id, deadline),
+                    range(args.concurrency),
+                )
+            )
+    finally:
+        process.terminate()
+        process.wait()
+    done = sum(r[0] for r in results)
+    failed = sum(r[1] for r in results)
+    print(f"{mode}: {done / args.duration:.1f} checkouts/s ({failed} failed)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--book-id", type=int, required=True)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    args = parser.parse_args()
+
+    monobank = serve(port=0, latency=args.latency)
+    threading.Thread(target=monobank.serve_forever, daemon=True).start()
+    monobank_url = f"http://127.0.0.1:{monobank.server_address[1]}"
+    for mode in args.modes:
+        run(mode, args, monobank_url)
+    monobank.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Concurrent checkouts per second on a single book, with and without stock
+shards. Runs create_order in-process against the configured database (use
+Postgres; SQLite serializes every writer anyway) and leaves the invoice
+tasks in the database task queue.
+
+    python -m benchmarks.bench_hot_book --concurrency 32 --shards 0 16
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "homework_20_api.settings")
+os.environ.setdefault("TASK_QUEUE", "api.tasks.DatabaseQueue")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+
+from api.inventory import set_stock  # noqa: E402
+from api.models import Author, Book, Order, Task  # noqa: E402
+from api.mono import create_order  # noqa: E402
+
+
+def worker(book, deadline):
+    done = failed = 0
+    try:
+        while time.monotonic() < deadline:
+            result = create_order([{"book_id": book, "quantity": 1}], "")
+            if "error" in result:
+                failed += 1
+            else:
+                done += 1
+    finally:
+        connection.close()
+    return done, failed
+
+
+def run(book, shards, concurrency, duration):
+    set_stock(book, 10**9, shards)
+    deadline = time.monotonic() + duration
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lambda _: worker(book, deadline), range(concurrency)))
+    done = sum(r[0] for r in results)
+    failed = sum(r[1] for r in results)
+    print(f"shards={shards}: {done / duration:.1f} orders/s ({failed} failed)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--shards", type=int, nargs="+", default=[0, 16])
+    args = parser.parse_args()
+
+    author, _ = Author.objects.get_or_create(name="Benchmark")
+    book = Book.objects.create(
+        title="Hot book",
+        author=author,
+        genre="Benchmark",
+        publication_date="2024-01-01",
+        price=100,
+        quantity=0,
+    )
+    last_task = Task.objects.order_by("-id").values_list("id", flat=True).first() or 0
+    try:
+        for shards in args.shards:
+            run(book, shards, args.concurrency, args.duration)
+    finally:
+        Task.objects.filter(id__gt=last_task, name="api.mono.create_invoice").delete()
+        Order.objects.filter(orderitem__book=book).delete()
+        book.delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Throughput of POST /api/order/ against a running server.
+
+    python -m benchmarks.fake_monobank --latency 2 &
+    MONOBANK_API_URL=http://127.0.0.1:8001 gunicorn homework_20_api.wsgi &
+    python -m benchmarks.bench_orders --book-id 1
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def worker(url, book_id, deadline):
+    session = requests.Session()
+    done = failed = 0
+    while time.monotonic() < deadline:
+        r = session.post(url, json={"order": [{"book_id": book_id, "quantity": 1}]})
+        if r.ok and "id" in r.json():
+            done += 1
+        else:
+            failed += 1
+    return done, failed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000/api/order/")
+    parser.add_argument("--book-id", type=int, required=True)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    deadline = time.monotonic() + args.duration
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(
+            pool.map(
+                lambda _: worker(args.url, args.book_id, deadline),
+                range(args.concurrency),
+            )
+        )
+    done = sum(r[0] for r in results)
+    failed = sum(r[1] for r in results)
+    print(f"{done / args.duration:.1f} orders/s ({done} ok, {failed} failed)")
+
+
+if __name__ == "__main__":
+    main()
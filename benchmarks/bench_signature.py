@@ -0,0 +1,68 @@
+"""
+Monobank callback signature verifications per second for each backend.
+
+    python -m benchmarks.bench_signature
+"""
+import argparse
+import hashlib
+import json
+import time
+
+import ecdsa
+
+from api.signatures import CryptographyVerifier, EcdsaVerifier
+
+CALLBACK = {
+    "invoiceId": "p2_9ZgpZVsl3",
+    "status": "success",
+    "payMethod": "pan",
+    "amount": 4200,
+    "ccy": 980,
+    "finalAmount": 4200,
+    "createdDate": "2024-05-05T12:00:00Z",
+    "modifiedDate": "2024-05-05T12:00:30Z",
+    "reference": "84d0070ee4e44667b31371d8f8813947",
+    "paymentInfo": {
+        "maskedPan": "444403******1902",
+        "approvalCode": "662476",
+        "rrn": "060189181768",
+        "tranId": "13194036",
+        "terminal": "MI001088",
+        "bank": "Універсал Банк",
+        "paymentSystem": "visa",
+        "country": "804",
+        "fee": 42,
+        "paymentMethod": "pan",
+    },
+}
+
+
+def measure(verifier, pem, signature, body, duration):
+    key = verifier.load_key(pem)
+    assert verifier.verify(key, signature, body)
+    count = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        verifier.verify(key, signature, body)
+        count += 1
+    return count / duration
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=3.0)
+    args = parser.parse_args()
+
+    signing_key = ecdsa.SigningKey.generate(curve=ecdsa.NIST256p)
+    pem = signing_key.get_verifying_key().to_pem()
+    body = json.dumps(CALLBACK, ensure_ascii=False).encode()
+    signature = signing_key.sign(
+        body, hashfunc=hashlib.sha256, sigencode=ecdsa.util.sigencode_der
+    )
+    for verifier in (CryptographyVerifier(), EcdsaVerifier()):
+        rate = measure(verifier, pem, signature, body, args.duration)
+        print(f"{type(verifier).__name__}: {rate:.0f} verifications/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Queries and time per authenticated write with JWTAuthentication, which loads
+the user row on every request, and with TokenUserAuthentication, which
+trusts the token claims and checks the user's state at most once per
+TOKEN_USER_STATE_TTL.
+
+    python -m benchmarks.bench_token_auth --requests 2000
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "homework_20_api.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+from rest_framework_simplejwt.authentication import JWTAuthentication  # noqa: E402
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+from api import views  # noqa: E402
+from api.authentication import TokenUserAuthentication  # noqa: E402
+from api.models import Author  # noqa: E402
+
+MODES = {"user-row": JWTAuthentication, "token-user": TokenUserAuthentication}
+
+
+def run(mode, client, author, requests):
+    views.AuthorUpdate.authentication_classes = [MODES[mode]]
+    queries = 0
+
+    def count(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    url = f"/api/authors/update/{author.id}/"
+    start = time.perf_counter()
+    with connection.execute_wrapper(count):
+        for n in range(requests):
+            response = client.put(url, {"name": f"Benchmark {n}"}, format="json")
+            assert response.status_code == 200, response.content
+    elapsed = time.perf_counter() - start
+    print(
+        f"{mode}: {queries / requests:.2f} queries/request, "
+        f"{elapsed / requests * 1000:.2f} ms/request"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    user, _ = User.objects.get_or_create(username="benchmark-token-auth")
+    author = Author.objects.create(name="Benchmark")
+    client = APIClient(SERVER_NAME="127.0.0.1")
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+    try:
+        for mode in MODES:
+            run(mode, client, author, args.requests)
+    finally:
+        author.delete()
+        user.delete()
+
+
+if __name__ == "__main__":
+    main()
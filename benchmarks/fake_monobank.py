@@ -0,0 +1,153 @@
+"""
+Local stand-in for the Monobank acquiring API: invoice creation, the
+public key and signed status webhooks, with configurable latency and
+failures.
+
+    python -m benchmarks.fake_monobank --latency 2 --failure-rate 0.05 --pay-after 1
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ecdsa
+import requests
+
+
+def public_key(signing_key):
+    return base64.b64encode(signing_key.get_verifying_key().to_pem()).decode()
+
+
+def sign(signing_key, body):
+    signature = signing_key.sign(
+        body, hashfunc=hashlib.sha256, sigencode=ecdsa.util.sigencode_der
+    )
+    return base64.b64encode(signature).decode()
+
+
+def callback_body(invoice_id, reference, amount, status):
+    return json.dumps(
+        {
+            "invoiceId": invoice_id,
+            "status": status,
+            "amount": amount,
+            "ccy": 980,
+            "reference": reference,
+            "modifiedDate": datetime.now(timezone.utc).isoformat(),
+        }
+    ).encode()
+
+
+def send_webhook(url, signing_key, body):
+    try:
+        requests.post(
+            url,
+            data=body,
+            headers={
+                "Content-Type": "application/json",
+                "X-Sign": sign(signing_key, body),
+            },
+            timeout=10,
+        )
+    except requests.RequestException:
+        pass
+
+
+class FakeMonobankHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    failure_rate = 0.0
+    pay_after = None
+    signing_key = None
+
+    def do_GET(self):
+        if self.path != "/api/merchant/pubkey":
+            self.send_error(404)
+            return
+        self.send_json({"key": public_key(self.signing_key)})
+
+    def do_POST(self):
+        if self.path != "/api/merchant/invoice/create":
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            self.send_json({"errCode": "ERROR", "errText": "Simulated failure"}, 500)
+            return
+        invoice_id = uuid.uuid4().hex
+        if self.pay_after is not None and body.get("webHookUrl"):
+            webhook = callback_body(
+                invoice_id,
+                body["merchantPaymInfo"]["reference"],
+                body["amount"],
+                "success",
+            )
+            threading.Timer(
+                self.pay_after,
+                send_webhook,
+                (body["webHookUrl"], self.signing_key, webhook),
+            ).start()
+        self.send_json(
+            {
+                "invoiceId": invoice_id,
+                "pageUrl": f"http://{self.headers['Host']}/pay/{invoice_id}",
+            }
+        )
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(
+    host="127.0.0.1",
+    port=8001,
+    latency=0.0,
+    failure_rate=0.0,
+    pay_after=None,
+    signing_key=None,
+):
+    handler = type(
+        "Handler",
+        (FakeMonobankHandler,),
+        {
+            "latency": latency,
+            "failure_rate": failure_rate,
+            "pay_after": pay_after,
+            "signing_key": signing_key
+            or ecdsa.SigningKey.generate(curve=ecdsa.NIST256p),
+        },
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.signing_key = handler.signing_key
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for Monobank.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=2.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--pay-after",
+        type=float,
+        help="Send a signed success webhook this many seconds after each invoice.",
+    )
+    args = parser.parse_args()
+    serve(
+        args.host, args.port, args.latency, args.failure_rate, args.pay_after
+    ).serve_forever()
@@ -0,0 +1,291 @@
+"""
+Scripted load scenarios reporting latency percentiles, requests per second
+and database queries per request as JSON, so runs on two commits can be
+compared.
+
+    python -m benchmarks.seed
+    python -m benchmarks.run --output before.json
+    git checkout other-branch
+    python -m benchmarks.run --output after.json --compare before.json
+
+Requests go through Django's test client in this process by default, with
+a local Monobank simulator, so queries can be counted. --url sends them to
+a running server instead; start it with MONOBANK_API_URL pointing at the
+simulator (--monobank-port) and the same database. Queries are not counted
+then. Checkout and webhook scenarios with concurrency need Postgres.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+from benchmarks.fake_monobank import callback_body, public_key, serve, sign
+
+
+class InProcessTarget:
+    def __init__(self):
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        from django.db import connection
+        from django.test import Client
+
+        if not hasattr(self.local, "client"):
+            self.local.client = Client(SERVER_NAME="127.0.0.1")
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count):
+            response = self.local.client.generic(
+                method,
+                path,
+                body or "",
+                content_type="application/json",
+                headers=headers,
+            )
+        elapsed = time.perf_counter() - start
+        return elapsed, response.status_code, queries, response
+
+
+class HttpTarget:
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        start = time.perf_counter()
+        response = self.local.session.request(
+            method,
+            self.url + path,
+            data=body,
+            headers={"Content-Type": "application/json", **(headers or {})},
+        )
+        return time.perf_counter() - start, response.status_code, None, response
+
+
+class Context:
+    def __init__(self, signing_key):
+        from api.models import Book, Order
+
+        self.signing_key = signing_key
+        self.book_ids = list(Book.objects.values_list("id", flat=True))
+        self.orders = list(
+            Order.objects.filter(invoice_id__isnull=False).values_list(
+                "id", "invoice_id", "total_price"
+            )[:10000]
+        )
+        if not self.book_ids or not self.orders:
+            raise SystemExit("Seed the database first: python -m benchmarks.seed")
+        self.words = sorted(
+            {
+                word
+                for title in Book.objects.values_list("title", flat=True)[:1000]
+                for word in title.lower().split()
+            }
+        )
+
+
+def browse(target, context, rng):
+    choice = rng.randrange(4)
+    if choice == 0:
+        offset = rng.randrange(max(len(context.book_ids) - 20, 1))
+        return [target.request("GET", f"/api/books/?limit=20&offset={offset}")]
+    if choice == 1:
+        book_id = rng.choice(context.book_ids)
+        return [target.request("GET", f"/api/books/{book_id}/")]
+    if choice == 2:
+        return [target.request("GET", "/api/books/?limit=20&expand=author&cursor=")]
+    return [target.request("GET", "/api/authors/?limit=20")]
+
+
+def search(target, context, rng):
+    word = rng.choice(context.words)
+    return [target.request("GET", f"/api/books/?search={word}&limit=20")]
+
+
+def checkout(target, context, rng):
+    basket = [
+        {"book_id": book_id, "quantity": 1}
+        for book_id in rng.sample(context.book_ids, rng.randint(1, 3))
+    ]
+    result = target.request("POST", "/api/order/", json.dumps({"order": basket}))
+    if result[1] != 202:
+        return [result]
+    order_id = result[3].json()["id"]
+    return [result, target.request("GET", f"/api/order/{order_id}/?wait=10")]
+
+
+def webhook_storm(target, context, rng):
+    order_id, invoice_id, amount = rng.choice(context.orders)
+    status = rng.choice(["processing", "success", "success", "failure"])
+    body = callback_body(invoice_id, str(order_id), amount, status)
+    headers = {"X-Sign": sign(context.signing_key, body)}
+    return [target.request("POST", "/api/monobank/callback", body, headers)]
+
+
+SCENARIOS = {
+    "browse": browse,
+    "search": search,
+    "checkout": checkout,
+    "webhook_storm": webhook_storm,
+}
+
+
+def run_scenario(scenario, target, context, concurrency, duration, seed):
+    def worker(n):
+        rng = random.Random(seed + n)
+        samples = []
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                results = scenario(target, context, rng)
+            except Exception:
+                samples.append((time.perf_counter() - start, 599, None))
+                continue
+            samples += [result[:3] for result in results]
+        return samples
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        samples = [s for result in pool.map(worker, range(concurrency)) for s in result]
+    return summarize(samples, duration)
+
+
+def summarize(samples, duration):
+    # Samples are (seconds, status, queries) per request.
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    if len(latencies) < 2:
+        latencies = latencies * 2 or [0.0, 0.0]
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    queries = [sample[2] for sample in samples if sample[2] is not None]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for sample in samples if sample[1] >= 400),
+        "rps": round(len(samples) / duration, 1),
+        "latency_ms": {
+            "p50": round(percentiles[49], 2),
+            "p95": round(percentiles[94], 2),
+            "p99": round(percentiles[98], 2),
+            "max": round(latencies[-1], 2),
+        },
+        "queries_per_request": (
+            round(statistics.mean(queries), 2) if queries else None
+        ),
+    }
+
+
+def compare(before, after):
+    print(f"{'scenario':<15}{'rps':>22}{'p95 ms':>24}{'queries':>18}")
+    for name, new in after["scenarios"].items():
+        old = before["scenarios"].get(name)
+        if old is None:
+            continue
+        print(
+            f"{name:<15}"
+            f"{old['rps']:>10} -> {new['rps']:<9}"
+            f"{old['latency_ms']['p95']:>11} -> {new['latency_ms']['p95']:<9}"
+            f"{str(old['queries_per_request']):>7} -> "
+            f"{str(new['queries_per_request']):<7}"
+        )
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="Base URL of a running server.")
+    parser.add_argument(
+        "--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--monobank-port", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file.")
+    parser.add_argument("--compare", help="Print a comparison with this report.")
+    args = parser.parse_args()
+
+    monobank = serve(
+        port=args.monobank_port, latency=args.latency, failure_rate=args.failure_rate
+    )
+    threading.Thread(target=monobank.serve_forever, daemon=True).start()
+    os.environ["MONOBANK_API_URL"] = f"http://127.0.0.1:{monobank.server_address[1]}"
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "homework_20_api.settings")
+
+    import django
+
+    django.setup()
+
+    from api.mono import key_cache
+    from api.models import MonoSettings
+
+    MonoSettings.objects.all().delete()
+    MonoSettings.objects.create(public_key=public_key(monobank.signing_key))
+    key_cache.clear()
+
+    target = HttpTarget(args.url) if args.url else InProcessTarget()
+    context = Context(monobank.signing_key)
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "target": args.url or "in-process",
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "monobank_latency": args.latency,
+            "monobank_failure_rate": args.failure_rate,
+            "books": len(context.book_ids),
+        },
+        "scenarios": {},
+    }
+    for name in args.scenarios:
+        report["scenarios"][name] = run_scenario(
+            SCENARIOS[name],
+            target,
+            context,
+            args.concurrency,
+            args.duration,
+            args.seed,
+        )
+    monobank.shutdown()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Fill the configured database with authors, books and paid orders for the
+benchmark scenarios.
+
+    python -m benchmarks.seed --authors 1000 --books 50000 --orders 20000
+"""
+import argparse
+import os
+import random
+import uuid
+from datetime import date, timedelta
+from itertools import islice
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "homework_20_api.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import transaction  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from api.models import Author, Book, Order, OrderItem  # noqa: E402
+from api.stats import rebuild_stats  # noqa: E402
+
+WORDS = (
+    "night river garden silent winter city stone shadow empire letters "
+    "journey ocean forest glass fire island memory summer kingdom light "
+    "secret machine storm house road crown dream war peace song"
+).split()
+NAMES = (
+    "Olena Taras Lesya Ivan Maria Mykola Sofia Andrii Iryna Oksana "
+    "Bohdan Yurii Hanna Vasyl Kateryna Dmytro"
+).split()
+GENRES = ["Fiction", "Poetry", "History", "Science", "Fantasy", "Drama"]
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def seed(authors, books, orders, quantity, days=1, batch_size=1000, rng=None):
+    rng = rng or random.Random(0)
+    with transaction.atomic():
+        author_ids = []
+        for batch in batched(range(authors), batch_size):
+            author_ids += [
+                author.id
+                for author in Author.objects.bulk_create(
+                    Author(name=f"{rng.choice(NAMES)} {rng.choice(WORDS).title()} {n}")
+                    for n in batch
+                )
+            ]
+        prices = {}
+        for batch in batched(range(books), batch_size):
+            for book in Book.objects.bulk_create(
+                Book(
+                    title=" ".join(rng.sample(WORDS, rng.randint(2, 4))).title(),
+                    author_id=rng.choice(author_ids),
+                    genre=rng.choice(GENRES),
+                    publication_date=date(1900, 1, 1)
+                    + timedelta(days=rng.randrange(45000)),
+                    price=rng.randrange(50, 2000),
+                    quantity=quantity,
+                )
+                for _ in batch
+            ):
+                prices[book.id] = book.price
+        book_ids = list(prices)
+        # Each batch of orders lands on one day, spread over the last `days`.
+        per_day = -(-orders // days)
+        now = timezone.now()
+        for batch in batched(range(orders), min(batch_size, per_day)):
+            baskets = [
+                {
+                    book_id: rng.randint(1, 3)
+                    for book_id in rng.sample(book_ids, rng.randint(1, 3))
+                }
+                for _ in batch
+            ]
+            created = Order.objects.bulk_create(
+                Order(
+                    total_price=sum(prices[k] * v for k, v in basket.items()),
+                    status="success",
+                    invoice_id=f"seed-{uuid.uuid4().hex}",
+                )
+                for basket in baskets
+            )
+            Order.objects.filter(id__in=[order.id for order in created]).update(
+                created_at=now - timedelta(days=batch[0] // per_day % days)
+            )
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, book_id=k, quantity=v, price=prices[k])
+                for order, basket in zip(created, baskets)
+                for k, v in basket.items()
+            )
+    rebuild_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--authors", type=int, default=100)
+    parser.add_argument("--books", type=int, default=5000)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--quantity", type=int, default=10**6)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    seed(
+        args.authors,
+        args.books,
+        args.orders,
+        args.quantity,
+        days=args.days,
+        rng=random.Random(args.seed),
+    )
+    print(f"Seeded {args.authors} authors, {args.books} books, {args.orders} orders.")
+
+
+if __name__ == "__main__":
+    main()
@@ -50,6 +50,7 @@ INSTALLED_APPS = [
     "rest_framework.authtoken",
     "rest_framework_simplejwt",
     "corsheaders",
+    "django_filters",
     "django.contrib.admin",
     "django.contrib.auth",
     "django.contrib.contenttypes",
@@ -60,6 +61,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.metrics.MetricsMiddleware",
+    "api.querycheck.QueryCheckMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -117,6 +120,23 @@ else:
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
+# New hashes use the first hasher; the others still verify old ones.
+PASSWORD_HASHER = os.getenv("PASSWORD_HASHER", "scrypt")
+PASSWORD_HASHERS = {
+    "scrypt": "api.hashers.ScryptPasswordHasher",
+    "argon2": "api.hashers.Argon2PasswordHasher",
+    "pbkdf2": "api.hashers.PBKDF2PasswordHasher",
+}
+PASSWORD_HASHERS = [
+    PASSWORD_HASHERS.pop(PASSWORD_HASHER),
+    *PASSWORD_HASHERS.values(),
+]
+PASSWORD_SCRYPT_WORK_FACTOR = int(os.getenv("PASSWORD_SCRYPT_WORK_FACTOR", 2**14))
+PASSWORD_ARGON2_TIME_COST = int(os.getenv("PASSWORD_ARGON2_TIME_COST", 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.getenv("PASSWORD_ARGON2_MEMORY_COST", 19456))
+PASSWORD_HASHING_WORKERS = int(os.getenv("PASSWORD_HASHING_WORKERS", 2))
+PASSWORD_HASHING_QUEUE = int(os.getenv("PASSWORD_HASHING_QUEUE", 8))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
@@ -169,6 +189,26 @@ if "DOCKER_APP" in os.environ:
         }
     }
 
+CATALOGUE_CACHE_TTL = 60
+
+# Bearer token required by /metrics when set.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Days newer than ANALYTICS_SETTLE_DAYS are recomputed on every request;
+# older ones are cached for ANALYTICS_CACHE_TTL seconds.
+ANALYTICS_SETTLE_DAYS = 2
+ANALYTICS_CACHE_TTL = 30 * 24 * 3600
+ANALYTICS_CHUNK_SIZE = 100_000
+ANALYTICS_WINDOW_DAYS = 31
+ANALYTICS_MAX_DAYS = 366
+
+# Flag N+1 patterns, slow queries and QUERY_BUDGETS overruns per request.
+QUERYCHECK = os.getenv("QUERYCHECK", "") == "1"
+QUERYCHECK_RAISE = False
+QUERYCHECK_REPEAT_THRESHOLD = 3
+QUERYCHECK_SLOW_MS = 100
+QUERY_BUDGETS = {}
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework_simplejwt.authentication.JWTAuthentication",
@@ -176,10 +216,48 @@ REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
     "PAGE_SIZE": 10,
     "DEFAULT_FILTER_BACKENDS": ["django_filters.rest_framework.DjangoFilterBackend"],
+    "DEFAULT_THROTTLE_RATES": {"auth_ip": "30/min", "auth_username": "10/min"},
 }
 
+# Seconds a user's active state is trusted by TokenUserAuthentication; None
+# skips the check.
+TOKEN_USER_STATE_TTL = 30
+
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOWED_ORIGINS = ["https://editor.swagger.io", "https://app.swaggerhub.com"]
 
 MONOBANK_API_KEY = os.getenv("MONOBANK_API_KEY")
+MONOBANK_API_URL = os.getenv("MONOBANK_API_URL", "https://api.monobank.ua")
+MONOBANK_TIMEOUT = (3.05, 10)
+MONOBANK_RETRIES = 2
+MONOBANK_POOL_SIZE = 10
+MONOBANK_ASYNC_POOL_SIZE = 100
+MONOBANK_BREAKER_THRESHOLD = 5
+MONOBANK_BREAKER_RESET = 30
+MONOBANK_PUBKEY_TTL = 3600
+MONOBANK_PUBKEY_REFRESH_INTERVAL = 60
+MONOBANK_SIGNATURE_BACKEND = "api.signatures.CryptographyVerifier"
+
+# Serve the order, callback and catalogue list endpoints with async views;
+# meant for `gunicorn homework_20_api.asgi -k uvicorn.workers.UvicornWorker`
+# together with TASK_QUEUE=api.tasks.AsyncioQueue.
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "") == "1"
+
+TASK_QUEUE = os.getenv("TASK_QUEUE", "api.tasks.InProcessQueue")
+TASK_QUEUE_WORKERS = int(os.getenv("TASK_QUEUE_WORKERS", 4))
+
+# Longest ?wait= on the order status endpoint: sync workers only wait
+# briefly, the ASGI view long-polls.
+ORDER_STATUS_SYNC_MAX_WAIT = 1
+ORDER_STATUS_MAX_WAIT = 10
+STOCK_HOLD_TTL = 15 * 60
+# Seconds stock levels shown on cached catalogue pages may lag behind.
+STOCK_CACHE_TTL = 2
+
+STOCK_GATE = os.getenv(
+    "STOCK_GATE",
+    "api.stockgate.RedisStockGate" if "DOCKER_APP" in os.environ else "",
+)
+STOCK_GATE_REDIS_URL = os.getenv("STOCK_GATE_REDIS_URL", "redis://redis:6379/1")
+STOCK_GATE_TIMEOUT = 0.1